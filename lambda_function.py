@@ -6,6 +6,7 @@ from pathlib import Path
 sys.path.append('/opt/python')
 
 os.environ['DJANGO_SETTINGS_MODULE'] = f'logsheet.settings'
+os.environ.setdefault('LOGSHEET_PROFILE', 'lean')
 from django.core.handlers import APIGatewayHandler
 
 handler = APIGatewayHandler()
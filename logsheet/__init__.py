@@ -1,3 +1,7 @@
-from .celery import app as celery_app
+import os
 
-__all__ = ('celery_app',)
+# Lean processes (the Lambda handler and CLI scripts) never dispatch tasks, so they don't pay for loading Celery
+if os.environ.get('LOGSHEET_PROFILE', 'full') != 'lean':
+    from .celery import app as celery_app
+
+    __all__ = ('celery_app',)
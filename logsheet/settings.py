@@ -4,6 +4,8 @@ from pathlib import Path
 from zoneinfo import ZoneInfo
 
 UNCHAINED = os.environ.get('UNCHAINED_TOML_PREFIX')
+# 'lean' is used by the Lambda handler and CLI scripts, which skip the apps only the server and workers need
+LEAN = os.environ.get('LOGSHEET_PROFILE', 'full') == 'lean'
 
 MAIN_APP = Path(__file__).resolve().parent
 BASE_DIR = MAIN_APP.parent
@@ -23,6 +25,8 @@ CACHE_CONFIG = SYSTEM_CONFIG['cache']
 TASK_QUEUES_CONFIG = SYSTEM_CONFIG['task_queues'][GLOBAL_CONFIG['queue_mode']]
 LANGFUSE_CONFIG = SYSTEM_CONFIG['langfuse']
 TIMESHEET = SYSTEM_CONFIG['timesheet']
+SYNC_CONFIG = SYSTEM_CONFIG.get('sync', {})
+INSTRUMENTATION_CONFIG = SYSTEM_CONFIG.get('instrumentation', {})
 
 ENVIRONMENT = SYSTEM_CONFIG['environment']
 os.environ.update(ENVIRONMENT)
@@ -53,8 +57,13 @@ INSTALLED_APPS = [
     'knox',
     'project'
 ]
+if LEAN:
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in {
+        'django.contrib.admin', 'django.contrib.gis', 'django_celery_beat', 'django_celery_results'
+    }]
 
 MIDDLEWARE = [
+    'project.instrumentation.InstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -128,6 +137,29 @@ CELERY_TASK_SEND_SENT_EVENT = True
 CELERY_SEND_EVENTS = True
 CELERY_TASK_ROUTES = {task_route: {'queue': TASK_QUEUES_CONFIG[task_route]} for task_route in TASK_QUEUES_CONFIG}
 
+SYNC_LOCK_TIMEOUT = int(SYNC_CONFIG.get('lock_timeout', 3600))
+SYNC_PROVIDER_CONCURRENCY = SYNC_CONFIG.get('provider_concurrency', {})
+SYNC_DEFAULT_PROVIDER_CONCURRENCY = int(SYNC_CONFIG.get('default_provider_concurrency', 4))
+INSTRUMENTATION_ENABLED = bool(INSTRUMENTATION_CONFIG.get('enabled', True))
+INSTRUMENTATION_SAMPLE_RATE = float(INSTRUMENTATION_CONFIG.get('sample_rate', 1.0))
+INSTRUMENTATION_METRICS_TOKEN = INSTRUMENTATION_CONFIG.get('metrics_token')
+
+# One JSON line per sampled request or task
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'project.instrumentation': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 cache_host = CACHE_CONFIG.get('host', 'localhost')
 cache_port = CACHE_CONFIG.get('port', '6379')
 cache_db = CACHE_CONFIG.get('db', '10')
@@ -150,8 +182,6 @@ STATIC_ROOT = BASE_DIR / 'static'
 
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
-for folder in [STATIC_ROOT, MEDIA_ROOT, TEMPLATE_ROOT]:
-    folder.mkdir(exist_ok=True, parents=True)
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
@@ -191,5 +221,6 @@ if UNCHAINED:
 
 if not UNCHAINED:
     REST_FRAMEWORK['DEFAULT_SCHEMA_CLASS'] = 'drf_spectacular.openapi.AutoSchema'
+if not UNCHAINED and not LEAN:
     for folder in [STATIC_ROOT, MEDIA_ROOT, TEMPLATE_ROOT]:
         folder.mkdir(exist_ok=True, parents=True)
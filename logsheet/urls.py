@@ -1,17 +1,18 @@
 from django.conf import settings
 from django.contrib import admin
-from django.urls import path
-from project import views
+from django.urls import include, path
+from project import instrumentation, views
 from django.contrib.auth import views as auth_views
 
 urlpatterns = [
     path('login/', auth_views.LoginView.as_view(), name='login'),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
     path('timesheet/<int:pk>/<str:month>', views.ProjectTimesheetListView.as_view(), name='timesheet'),
-
+    path('api/', include('project.urls')),
+    path('metrics', instrumentation.metrics_view, name='metrics'),
 ]
 
-if not settings.UNCHAINED:
+if not settings.UNCHAINED and not settings.LEAN:
     urlpatterns += [
         path("admin/", admin.site.urls),
     ]
@@ -14,3 +14,5 @@ class SourceAdmin(admin.ModelAdmin):
 
 admin.site.register(models.Project)
 admin.site.register(models.Event)
+admin.site.register(models.SourceSyncRun)
+admin.site.register(models.ImportedFile)
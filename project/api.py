@@ -0,0 +1,98 @@
+import csv
+
+import django_filters
+from django.http import StreamingHttpResponse
+from rest_framework import permissions, viewsets
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+
+from . import models, serializers
+
+
+class DateCursorPagination(CursorPagination):
+    page_size = 100
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    ordering = ('-date', '-id')
+
+
+class MonthCursorPagination(DateCursorPagination):
+    ordering = ('-month', '-id')
+
+
+class ProjectCursorPagination(DateCursorPagination):
+    ordering = ('id',)
+
+
+class TimeEntryFilter(django_filters.FilterSet):
+    date = django_filters.DateFromToRangeFilter()
+
+    class Meta:
+        model = models.TimeEntry
+        fields = ['date', 'billable', 'project']
+
+
+class MonthlySummaryFilter(django_filters.FilterSet):
+    month = django_filters.DateFromToRangeFilter()
+
+    class Meta:
+        model = models.ProjectMonthRollup
+        fields = ['month', 'project']
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+class VisibleToUserMixin:
+    permission_classes = [permissions.IsAuthenticated]
+    ordering_fields = []
+    project_lookup = 'project__client__user'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.user.is_superuser:
+            return queryset
+        return queryset.filter(**{self.project_lookup: self.request.user})
+
+
+class ProjectViewSet(VisibleToUserMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = models.Project.objects.only(
+        'id', 'name', 'client_id', 'project_start_date', 'monthly_duration', 'total_duration', 'harvest_id')
+    serializer_class = serializers.ProjectSerializer
+    pagination_class = ProjectCursorPagination
+    filterset_fields = ['client']
+    project_lookup = 'client__user'
+
+
+class MonthlySummaryViewSet(VisibleToUserMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = models.ProjectMonthRollup.objects.defer('updated_at')
+    serializer_class = serializers.MonthlySummarySerializer
+    pagination_class = MonthCursorPagination
+    filterset_class = MonthlySummaryFilter
+
+
+class TimeEntryViewSet(VisibleToUserMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = models.TimeEntry.objects.only('id', 'project_id', 'date', 'hours', 'notes', 'billable', 'harvest_id')
+    serializer_class = serializers.TimeEntrySerializer
+    pagination_class = DateCursorPagination
+    filterset_class = TimeEntryFilter
+    export_chunk_size = 2000
+
+    @action(detail=False)
+    def export(self, request):
+        queryset = self.filter_queryset(self.get_queryset()).order_by('date', 'id').values_list(
+            'date', 'project__name', 'hours', 'billable', 'notes', 'harvest_id')
+        writer = csv.writer(Echo())
+
+        def rows():
+            # Byte order mark so Excel opens the file as UTF-8
+            yield '\ufeff' + writer.writerow(['date', 'project', 'hours', 'billable', 'notes', 'harvest_id'])
+            # iterator() reads through a server-side cursor on Postgres
+            for date, project, hours, billable, notes, harvest_id in queryset.iterator(self.export_chunk_size):
+                yield writer.writerow([date, project, round(hours.total_seconds() / 3600, 2), billable, notes, harvest_id])
+
+        response = StreamingHttpResponse(rows(), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="time-entries.csv"'
+        return response
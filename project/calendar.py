@@ -1,11 +1,23 @@
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 
-import requests
-import msal
 from django.conf import settings
 
+from project.instrumentation import in_current_context, instrumented_session
+from project.tokens import get_graph_token
+from utils import LazyImport
+
+requests = LazyImport('requests')
+
 
 class AzureCalendarExport:
+    batch_size = 20
+    max_workers = 4
+    max_retries = 5
+    page_size = 1000
+    ENDPOINT = 'https://graph.microsoft.com/v1.0'
+
     def __init__(self):
         calendar_settings = settings.SYSTEM_CONFIG['calendar']
         self.CLIENT_ID = calendar_settings['CLIENT_ID']
@@ -15,18 +27,10 @@ class AzureCalendarExport:
         self.CALENDAR_ID = calendar_settings['CALENDAR_ID']
         self.AUTHORITY = f'https://login.microsoftonline.com/{self.TENANT_ID}'
         self.SCOPE = ['https://graph.microsoft.com/.default']
-        self.ENDPOINT = 'https://graph.microsoft.com/v1.0'
         self._access_token = None
 
     def get_access_token(self):
-        app = msal.ConfidentialClientApplication(
-            self.CLIENT_ID, authority=self.AUTHORITY,
-            client_credential=self.CLIENT_SECRET
-        )
-        result = app.acquire_token_silent(self.SCOPE, account=None)
-        if not result:
-            result = app.acquire_token_for_client(scopes=self.SCOPE)
-        return result['access_token']
+        return get_graph_token(self.TENANT_ID, self.CLIENT_ID, self.CLIENT_SECRET)
 
     @property
     def token(self):
@@ -34,12 +38,60 @@ class AzureCalendarExport:
             self._access_token = self.get_access_token()
         return self._access_token
 
-    @property
+    @cached_property
     def requester(self):
-        session = requests.session()
+        session = instrumented_session()
         session.headers = {'Authorization': f'Bearer {self.token}'}
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.max_workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
         return session
 
+    @property
+    def events_path(self):
+        return f'/users/{self.USER_ID}/calendars/{self.CALENDAR_ID}/events'
+
+    def send_batch(self, batch_requests):
+        responses = {}
+        pending = {request['id']: request for request in batch_requests}
+        for attempt in range(self.max_retries + 1):
+            response = self.requester.post(f'{self.ENDPOINT}/$batch', json={'requests': list(pending.values())})
+            # The whole batch can be throttled or fail upstream too, not just requests inside it
+            if (response.status_code == 429 or response.status_code >= 500) and attempt < self.max_retries:
+                time.sleep(float(response.headers.get('Retry-After', 2 ** attempt)))
+                continue
+            response.raise_for_status()
+            retry_after = 0
+            for item in response.json()['responses']:
+                if item['status'] == 429 and attempt < self.max_retries:
+                    retry_after = max(retry_after, float(item.get('headers', {}).get('Retry-After', 2 ** attempt)))
+                    continue
+                responses[item['id']] = item
+                pending.pop(item['id'])
+            if not pending:
+                break
+            time.sleep(retry_after)
+        return responses
+
+    def execute_batches(self, batch_requests):
+        # Graph accepts 20 requests per $batch and allows 4 concurrent requests per mailbox
+        chunks = [batch_requests[i:i + self.batch_size] for i in range(0, len(batch_requests), self.batch_size)]
+        responses = {}
+        send_batch = in_current_context(self.send_batch)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [(chunk, executor.submit(send_batch, chunk)) for chunk in chunks]
+            for chunk, future in futures:
+                # A failed chunk is reported as failed requests, so callers still record what the other
+                # chunks already created on the calendar
+                try:
+                    responses.update(future.result())
+                except requests.RequestException as error:
+                    print(f'Calendar batch of {len(chunk)} requests failed: {error}')
+                    status = getattr(error.response, 'status_code', None) or 503
+                    responses.update({request['id']: {'id': request['id'], 'status': status, 'body': str(error)}
+                                      for request in chunk})
+        return responses
+
     def get_calendars(self):
         response = self.requester.get(f'{self.ENDPOINT}/users/{self.USER_ID}/calendars')
         response.raise_for_status()
@@ -71,11 +123,19 @@ class AzureCalendarExport:
             }
         }
 
-    def list_events(self):
-        response = self.requester.get(
-            f'{self.ENDPOINT}/users/{self.USER_ID}/calendars/{self.CALENDAR_ID}/events')
-        response.raise_for_status()
-        return response.json()['value']
+    def list_events(self, select='subject,start,end'):
+        url = f'{self.ENDPOINT}{self.events_path}'
+        params = {'$select': select, '$top': self.page_size}
+        headers = {'Prefer': 'outlook.timezone="AUS Eastern Standard Time"'}
+        events = []
+        while url:
+            response = self.requester.get(url, params=params, headers=headers)
+            response.raise_for_status()
+            data = response.json()
+            events.extend(data['value'])
+            url = data.get('@odata.nextLink')
+            params = {}
+        return events
 
     def delete_event(self, event_id):
         response = self.requester.delete(
@@ -84,18 +144,73 @@ class AzureCalendarExport:
         return response.status_code == 204
 
     def clear_calendar(self):
-        events = self.list_events()
-        total_events = len(events)
-        deleted_count = 0
-
-        for event in events:
-            if self.delete_event(event['id']):
-                deleted_count += 1
-                print(f"Deleted event: {event['subject']} ({deleted_count}/{total_events})")
-            else:
-                print(f"Failed to delete event: {event['subject']}")
-
-        print(f"Deleted {deleted_count} out of {total_events} events.")
+        events = self.list_events(select='subject')
+        responses = self.execute_batches([{
+            'id': event['id'],
+            'method': 'DELETE',
+            'url': f"{self.events_path}/{event['id']}"
+        } for event in events])
+        deleted_count = sum(response['status'] == 204 for response in responses.values())
+        print(f"Deleted {deleted_count} out of {len(events)} events.")
 
     def add_event_block(self, event_block):
-        self.update_event(self.format_event_block(event_block))
+        return self.update_event(self.format_event_block(event_block))
+
+    @staticmethod
+    def event_differs(remote_event, formatted_event):
+        return (
+            remote_event.get('subject') != formatted_event['subject']
+            or remote_event['start']['dateTime'][:19] != formatted_event['start']['dateTime']
+            or remote_event['end']['dateTime'][:19] != formatted_event['end']['dateTime']
+        )
+
+    def sync_event_blocks(self, event_blocks):
+        # Mirror event_blocks onto the calendar; remote events no block refers to are deleted
+        remote_events = {event['id']: event for event in self.list_events()}
+        event_blocks = {str(event_block.pk): event_block for event_block in event_blocks}
+        batch_requests = []
+        for block_id, event_block in event_blocks.items():
+            formatted_event = self.format_event_block(event_block)
+            remote_event = remote_events.pop(event_block.graph_event_id, None)
+            if remote_event is None:
+                batch_requests.append({'id': f'create-{block_id}', 'method': 'POST', 'url': self.events_path,
+                                       'body': formatted_event, 'headers': {'Content-Type': 'application/json'}})
+            elif self.event_differs(remote_event, formatted_event):
+                batch_requests.append({'id': f'update-{block_id}', 'method': 'PATCH',
+                                       'url': f'{self.events_path}/{event_block.graph_event_id}',
+                                       'body': formatted_event, 'headers': {'Content-Type': 'application/json'}})
+        for event_id in remote_events:
+            batch_requests.append({'id': f'delete-{event_id}', 'method': 'DELETE',
+                                   'url': f'{self.events_path}/{event_id}'})
+
+        created = []
+        counts = {'created': 0, 'updated': 0, 'deleted': 0}
+        for request_id, response in self.execute_batches(batch_requests).items():
+            action, key = request_id.split('-', 1)
+            if response['status'] >= 300:
+                print(f"Failed to {action} calendar event {key}: {response['status']} {response.get('body')}")
+                continue
+            counts[f'{action}d'] += 1
+            if action == 'create':
+                event_block = event_blocks[key]
+                event_block.graph_event_id = response['body']['id']
+                event_block.uploaded_to_calendar = True
+                created.append(event_block)
+        return created, counts
+
+    def add_event_blocks(self, event_blocks):
+        event_blocks = {str(event_block.pk): event_block for event_block in event_blocks}
+        responses = self.execute_batches([{
+            'id': block_id,
+            'method': 'POST',
+            'url': self.events_path,
+            'body': self.format_event_block(event_block),
+            'headers': {'Content-Type': 'application/json'}
+        } for block_id, event_block in event_blocks.items()])
+        created = {}
+        for block_id, response in responses.items():
+            if response['status'] == 201:
+                created[event_blocks[block_id]] = response['body']
+            else:
+                print(f"Failed to add {event_blocks[block_id]} to calendar: {response['status']} {response.get('body')}")
+        return created
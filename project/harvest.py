@@ -1,34 +1,100 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import cached_property
 
-import requests
 from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 
-from project.models import Client, Project, TimeEntry
+from project.instrumentation import in_current_context, instrumented_session
+from project.models import Client, HarvestWatermark, Project, ProjectMonthRollup, TimeEntry
+from utils import LazyImport
+
+requests = LazyImport('requests')
 
 
 class Harvest:
+    base_url = 'https://api.harvestapp.com/v2'
+    batch_size = 1000
+    per_page = 2000
+    max_workers = 4
+    max_retries = 5
+    full_sync_interval = timezone.timedelta(days=1)
+    # Allowance for clock skew between this host and Harvest when resuming from the fetch start time
+    watermark_margin = timezone.timedelta(minutes=5)
+
     @cached_property
     def requester(self):
-        session = requests.session()
+        session = instrumented_session()
         session.headers = {
             'Authorization': f'Bearer {settings.SYSTEM_CONFIG["harvest"]["access_token"]}',
             'Harvest-Account-Id': settings.SYSTEM_CONFIG["harvest"]["account_id"],
         }
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
         return session
 
-    def get_clients(self):
-        response = self.requester.get("https://api.harvestapp.com/v2/clients")
-        clients_data = response.json()['clients']
+    def request(self, method, path, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            response = self.requester.request(method, f'{self.base_url}/{path}', **kwargs)
+            if response.status_code != 429 or attempt == self.max_retries:
+                break
+            time.sleep(float(response.headers.get('Retry-After', 2 ** attempt)))
+        response.raise_for_status()
+        return response
+
+    def get_page(self, path, params, page):
+        return self.request('GET', path, params={**params, 'page': page, 'per_page': self.per_page}).json()
+
+    def get_all(self, path, params=None):
+        params = params or {}
+        first_page = self.get_page(path, params, 1)
+        # Pages are read by number from live data, so a record edited mid-fetch can shift onto a later page
+        # and come back twice; the copy seen last wins
+        records = {record['id']: record for record in first_page[path]}
+        pages = range(2, (first_page.get('total_pages') or 1) + 1)
+        get_page = in_current_context(lambda page_number: self.get_page(path, params, page_number))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for page in executor.map(get_page, pages):
+                records.update((record['id'], record) for record in page[path])
+        return list(records.values())
+
+    def get_updated(self, resource, params=None, full=False, watermark_key=None):
+        watermark, _ = HarvestWatermark.objects.get_or_create(resource=watermark_key or resource)
+        params = dict(params or {})
+        if watermark.updated_since and not full:
+            params['updated_since'] = watermark.updated_since.isoformat()
+        # Records edited while the pages are being read may come back with their old updated_at or not at all,
+        # so the next run resumes from when this fetch started rather than from the newest record seen
+        watermark.fetch_started_at = timezone.now()
+        return watermark, self.get_all(resource, params)
+
+    def advance_watermark(self, watermark, full=False):
+        watermark.updated_since = watermark.fetch_started_at - self.watermark_margin
+        if full:
+            watermark.last_full_sync = timezone.now()
+        watermark.save()
+
+    def needs_full_sync(self):
+        last_full_sync = HarvestWatermark.objects.filter(
+            resource='time_entries').values_list('last_full_sync', flat=True).first()
+        return not last_full_sync or timezone.now() - last_full_sync > self.full_sync_interval
+
+    def get_clients(self, full=True):
+        watermark, clients_data = self.get_updated('clients', full=full)
         for client_data in clients_data:
             Client.objects.update_or_create(
                 harvest_id=client_data['id'],
                 defaults={'name': client_data['name']}
             )
+        self.advance_watermark(watermark, full)
+        return len(clients_data)
 
-    def get_projects(self):
-        response = self.requester.get("https://api.harvestapp.com/v2/projects")
-        projects_data = response.json()['projects']
+    def get_projects(self, full=True):
+        watermark, projects_data = self.get_updated('projects', full=full)
         for project_data in projects_data:
             client, _ = Client.objects.get_or_create(harvest_id=project_data['client']['id'])
             Project.objects.update_or_create(
@@ -39,44 +105,113 @@ class Harvest:
                     'client': client
                 }
             )
+        self.advance_watermark(watermark, full)
+        return len(projects_data)
 
-    def get_time_entries(self, start_date, end_date):
+    def get_time_entries(self, start_date, end_date, full=True, harvest_project_id=None):
         params = {
             'from': start_date.isoformat(),
             'to': end_date.isoformat()
         }
-        response = self.requester.get("https://api.harvestapp.com/v2/time_entries", params=params)
-        time_entries_data = response.json()['time_entries']
-        
-        # Track harvest IDs that still exist
-        harvest_ids = []
-        
+        watermark_key = 'time_entries'
+        if harvest_project_id:
+            params['project_id'] = harvest_project_id
+            # Scoped fetches keep their own watermark so they can't skip entries for the global sync
+            watermark_key = f'time_entries:{harvest_project_id}'
+        watermark, time_entries_data = self.get_updated('time_entries', params, full, watermark_key)
+        counts = self.save_time_entries(
+            time_entries_data, start_date, end_date, reconcile=full, harvest_project_id=harvest_project_id)
+        self.advance_watermark(watermark, full)
+        return counts
+
+    def save_time_entries(self, time_entries_data, start_date, end_date, reconcile=True, harvest_project_id=None):
+        project_ids = {str(entry_data['project']['id']) for entry_data in time_entries_data}
+        projects = {project.harvest_id: project for project in Project.objects.filter(harvest_id__in=project_ids)}
+
+        # Keyed by harvest_id, as a repeated record would make the upsert touch the same row twice and fail
+        time_entries = {}
         for entry_data in time_entries_data:
-            harvest_ids.append(entry_data['id'])
-            project = Project.objects.get(harvest_id=entry_data['project']['id'])
-            TimeEntry.objects.update_or_create(
-                harvest_id=entry_data['id'],
-                defaults={
-                    'project': project,
-                    'date': entry_data['spent_date'],
-                    'hours': timezone.timedelta(hours=entry_data['hours']),
-                    'notes': entry_data['notes'],
-                    'billable': entry_data['billable']
-                }
+            project = projects.get(str(entry_data['project']['id']))
+            if project is None:
+                print(f"Skipping time entry {entry_data['id']}: project {entry_data['project']['id']} not synced")
+                continue
+            time_entries[str(entry_data['id'])] = TimeEntry(
+                harvest_id=str(entry_data['id']),
+                project=project,
+                date=parse_date(entry_data['spent_date']),
+                hours=timezone.timedelta(hours=entry_data['hours']),
+                notes=entry_data['notes'],
+                billable=entry_data['billable']
             )
-        
-        # Delete time entries that no longer exist in Harvest
-        TimeEntry.objects.filter(
-            date__gte=start_date,
-            date__lte=end_date
-        ).exclude(harvest_id__in=harvest_ids).delete()
-
-    def sync_all_data(self, days=30):
-        self.get_clients()
-        self.get_projects()
+        time_entries = list(time_entries.values())
+        harvest_ids = list({str(entry_data['id']) for entry_data in time_entries_data})
+
+        with transaction.atomic():
+            existing = {row[0]: row[1:] for row in TimeEntry.objects.filter(
+                harvest_id__in=RawSQL('SELECT unnest(%s::varchar[])', [harvest_ids])
+            ).values_list('harvest_id', 'project_id', 'date', 'hours', 'notes', 'billable')}
+            TimeEntry.objects.bulk_create(
+                time_entries,
+                batch_size=self.batch_size,
+                update_conflicts=True,
+                unique_fields=['harvest_id'],
+                update_fields=['project', 'date', 'hours', 'notes', 'billable']
+            )
+            deleted = []
+            if reconcile:
+                deleted = self.delete_missing_time_entries(harvest_ids, start_date, end_date, harvest_project_id)
+            in_window = TimeEntry.objects.filter(date__gte=start_date, date__lte=end_date).count()
+
+            changes = list(deleted)
+            for time_entry in time_entries:
+                previous = existing.get(time_entry.harvest_id)
+                current = (time_entry.project_id, time_entry.date, time_entry.hours, time_entry.notes,
+                           time_entry.billable)
+                if previous != current:
+                    changes += [current[:2], previous[:2]] if previous else [current[:2]]
+            changed_dates = {}
+            for project_id, date in changes:
+                changed_dates[project_id] = min(date, changed_dates.get(project_id, date))
+            ProjectMonthRollup.refresh_projects(changed_dates)
+
+        updated = sum(time_entry.harvest_id in existing for time_entry in time_entries)
+        return {
+            'fetched': len(time_entries_data),
+            'skipped': max(in_window - len(time_entries), 0),
+            'inserted': len(time_entries) - updated,
+            'updated': updated,
+            'deleted': len(deleted),
+        }
+
+    def delete_missing_time_entries(self, harvest_ids, start_date, end_date, harvest_project_id=None):
+        # Anti-join against the fetched IDs sent as one array parameter, scoped to the synced projects
+        project_filter = 'harvest_id IS NOT NULL'
+        params = [start_date, end_date]
+        if harvest_project_id:
+            project_filter = 'harvest_id = %s'
+            params.append(str(harvest_project_id))
+        params.append(harvest_ids)
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                DELETE FROM {TimeEntry._meta.db_table} AS time_entry
+                WHERE time_entry.date BETWEEN %s AND %s
+                  AND time_entry.project_id IN (SELECT id FROM {Project._meta.db_table} WHERE {project_filter})
+                  AND NOT EXISTS (
+                      SELECT 1 FROM unnest(%s::varchar[]) AS fetched(harvest_id)
+                      WHERE fetched.harvest_id = time_entry.harvest_id
+                  )
+                RETURNING time_entry.project_id, time_entry.date
+            ''', params)
+            return cursor.fetchall()
+
+    def sync_all_data(self, days=30, full=None):
+        if full is None:
+            full = self.needs_full_sync()
+        self.get_clients(full)
+        self.get_projects(full)
         end_date = timezone.now().astimezone(settings.AS_LOCAL_TIME_ZONE).date()
         start_date = end_date - timezone.timedelta(days=days)
-        self.get_time_entries(start_date, end_date)
+        return {'mode': 'full' if full else 'incremental', **self.get_time_entries(start_date, end_date, full)}
 
     def post_time_entry(self, time_entry):
         data = {
@@ -85,7 +220,7 @@ class Harvest:
             "hours": str(time_entry.hours),
             "notes": time_entry.notes
         }
-        response = self.requester.post("https://api.harvestapp.com/v2/time_entries", json=data)
+        response = self.requester.post(f'{self.base_url}/time_entries', json=data)
         if response.status_code == 201:
             time_entry.harvest_id = response.json()['id']
             time_entry.save()
@@ -93,6 +228,6 @@ class Harvest:
         return False
 
 
-def sync_harvest_data(days=30):
+def sync_harvest_data(days=30, full=None):
     harvest = Harvest()
-    harvest.sync_all_data(days)
+    return harvest.sync_all_data(days, full)
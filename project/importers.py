@@ -1,65 +1,206 @@
 import csv
+import hashlib
+import shutil
 from abc import ABC, abstractmethod
-from datetime import datetime, timedelta
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import cached_property
 from io import StringIO
+from multiprocessing import current_process
 from pathlib import Path
 
-import requests
+from django.core.cache import cache
+from django.db import transaction
 from django.utils import timezone
-from msal import ConfidentialClientApplication
+
+from project.instrumentation import instrumented_session, record_cache
+from project.tokens import get_graph_token
+from utils import LazyImport
+
+requests = LazyImport('requests')
 
 
 class BaseImporter(ABC):
+    chunk_size = 1000
+    checkpoint_fields = ['checkpoint']
+
     def __init__(self, source):
         self.source = source
         self.batch = []
+        self.event_count = 0
+        self.checkpoint = source.checkpoint
+        self.started_at = None
 
     @abstractmethod
     def fetch_events(self):
         pass
 
+    @cached_property
+    def rule_matcher(self):
+        return self.source.rule_matcher()
+
     def sync(self):
+        self.started_at = timezone.now()
         self.fetch_events()
-        self.source.event_set.bulk_create(self.batch, ignore_conflicts=True)
-        self.batch = []
+        self.flush()
         self.update_last_sync()
+        return self.event_count
 
     def save_event(self, event_text: str, timestamp: datetime):
-        if any(rule.check_rule(event_text) for rule in self.source.sourcerule_set.all()):
-            self.batch.append(self.source.event_set.model(
+        if self.rule_matcher.match(event_text):
+            event_model = self.source.event_set.model
+            self.batch.append(event_model(
                 source=self.source,
                 event_text=event_text,
+                event_hash=event_model.hash_text(event_text),
                 timestamp=timestamp
             ))
+            if len(self.batch) >= self.chunk_size:
+                self.flush()
+
+    def set_checkpoint(self, checkpoint):
+        # Where to resume from; every event before it has already been passed to save_event
+        self.checkpoint = checkpoint
+
+    def flush(self):
+        with transaction.atomic():
+            self.source.event_set.bulk_create(self.batch, ignore_conflicts=True, batch_size=self.chunk_size)
+            self.source.event_set.model.queue_grouping(
+                self.source.project_id, [event.timestamp for event in self.batch])
+            self.source.checkpoint = self.checkpoint
+            self.source.save(update_fields=self.checkpoint_fields)
+        self.event_count += len(self.batch)
+        self.batch = []
 
     def update_last_sync(self):
-        self.source.last_sync = timezone.now()
+        self.source.last_sync = self.started_at or timezone.now()
+        self.source.checkpoint = None
         self.source.save()
 
 
 class GitHubImporter(BaseImporter):
+    per_page = 100
+    etag_timeout = 60 * 60 * 24 * 7
+
+    def __init__(self, source):
+        super().__init__(source)
+        self.pending_etags = {}
+
+    def first_page_url(self):
+        params = {'per_page': self.per_page}
+        if self.source.last_sync:
+            # Truncated to the day so the URL, and therefore its ETag, stays stable between syncs
+            params['since'] = f'{self.source.last_sync.astimezone(dt_timezone.utc).date().isoformat()}T00:00:00Z'
+        return requests.Request('GET', self.source.base_url, params=params).prepare().url
+
+    def etag_cache_key(self, url):
+        return f'github-etag:{self.source.pk}:{hashlib.sha1(url.encode()).hexdigest()}'
+
     def fetch_events(self):
-        headers = {"Authorization": f"token {self.source.api_key}"}
-        url = self.source.base_url
+        session = instrumented_session()
+        session.headers = {"Authorization": f"token {self.source.api_key}"}
+        url = self.checkpoint or self.first_page_url()
         while url:
-            response = requests.get(url, headers=headers)
-            commits = response.json()
-            for commit in commits:
+            etag = cache.get(self.etag_cache_key(url))
+            record_cache(bool(etag))
+            response = session.get(url, headers={'If-None-Match': etag} if etag else {})
+            if response.status_code == 304:
+                # Commits are newest first, so an unchanged page means nothing after it changed either
+                break
+            response.raise_for_status()
+            for commit in response.json():
                 self.save_event(commit['commit']['message'], commit['commit']['author']['date'])
+            if response.headers.get('ETag'):
+                self.pending_etags[self.etag_cache_key(url)] = response.headers['ETag']
             url = response.links.get('next', {}).get('url')
+            self.set_checkpoint(url)
+
+    def flush(self):
+        super().flush()
+        # Only remember a page's ETag once its events are stored, or a crash would hide them behind a 304
+        cache.set_many(self.pending_etags, timeout=self.etag_timeout)
+        self.pending_etags = {}
+
+
+def parse_azure_csv(file_path, known_hash=None):
+    # Runs in a worker process, so it only returns plain data
+    content = file_path.read_bytes()
+    content_hash = hashlib.sha256(content).hexdigest()
+    # Touched but unchanged files only need their manifest entry refreshed
+    if content_hash == known_hash:
+        return content_hash, []
+    rows = [
+        ('\n'.join(f'{key}: {value}' for key, value in row.items()), row['Time'])
+        for row in csv.DictReader(StringIO(content.decode()))
+    ]
+    return content_hash, rows
 
 
 class AzureImporter(BaseImporter):
+    directory = Path('media/azure')
+    max_workers = 4
+
+    def __init__(self, source):
+        super().__init__(source)
+        self.pending_files = []
+
+    def changed_files(self):
+        manifest = {imported_file.path: imported_file for imported_file in self.source.importedfile_set.all()}
+        for file_path in sorted(self.directory.glob('*.csv')):
+            stat = file_path.stat()
+            imported_file = manifest.get(file_path.name) or self.source.importedfile_set.model(
+                source=self.source, path=file_path.name)
+            modified_at = datetime.fromtimestamp(stat.st_mtime, tz=dt_timezone.utc)
+            if imported_file.size == stat.st_size and imported_file.modified_at == modified_at:
+                continue
+            imported_file.size = stat.st_size
+            imported_file.modified_at = modified_at
+            yield file_path, imported_file
+
     def fetch_events(self):
-        for file_path in Path('media/azure').glob('*.csv'):
-            self.process_csv_file(file_path)
+        changed_files = list(self.changed_files())
+        if not changed_files:
+            return
+        workers = min(self.max_workers, len(changed_files))
+        in_flight = deque()
+        # Celery prefork workers are daemonic and can't start child processes, so they parse in threads
+        executor_class = ThreadPoolExecutor if current_process().daemon else ProcessPoolExecutor
+        with executor_class(max_workers=workers) as executor:
+            # Only one file per worker is parsed ahead of the one being saved, so a large backlog of files
+            # isn't held in memory at once
+            for file_path, imported_file in changed_files:
+                parsed = executor.submit(parse_azure_csv, file_path, imported_file.content_hash)
+                in_flight.append((file_path, imported_file, parsed))
+                if len(in_flight) > workers:
+                    self.save_parsed_file(*in_flight.popleft())
+            while in_flight:
+                self.save_parsed_file(*in_flight.popleft())
 
-    def process_csv_file(self, file_path):
-        with file_path.open('r') as csv_file:
-            csv_reader = csv.DictReader(csv_file)
-            for row in csv_reader:
-                event_text = '\n'.join(f'{key}: {value}' for key, value in row.items())
-                self.save_event(event_text, row['Time'])
+    def save_parsed_file(self, file_path, imported_file, parsed):
+        content_hash, rows = parsed.result()
+        for event_text, timestamp in rows:
+            self.save_event(event_text, timestamp)
+        imported_file.content_hash = content_hash
+        self.pending_files.append((file_path, imported_file))
+
+    def flush(self):
+        # Files are only marked as imported together with their events
+        pending_files, self.pending_files = self.pending_files, []
+        with transaction.atomic():
+            super().flush()
+            self.source.importedfile_set.bulk_create(
+                [imported_file for _, imported_file in pending_files],
+                update_conflicts=True,
+                unique_fields=['source', 'path'],
+                update_fields=['size', 'modified_at', 'content_hash', 'imported_at'],
+            )
+        archive_dir = (self.source.auth_dict or {}).get('archive_dir')
+        if archive_dir:
+            Path(archive_dir).mkdir(parents=True, exist_ok=True)
+            for file_path, _ in pending_files:
+                # The archive may be on another filesystem, where a plain rename fails
+                shutil.move(file_path, Path(archive_dir) / file_path.name)
 
 
 class AWSImporter(BaseImporter):
@@ -78,40 +219,54 @@ class SlackImporter(BaseImporter):
 
 
 class OutlookImporter(BaseImporter):
+    graph_url = 'https://graph.microsoft.com/v1.0'
+    page_size = 1000
+    default_folders = ['inbox', 'sentitems']
+    checkpoint_fields = ['checkpoint', 'delta_links']
+
     def __init__(self, source):
         super().__init__(source)
         self.access_token = self._get_access_token()
+        self.pending_delta_links = {}
 
     def _get_access_token(self):
-        app = ConfidentialClientApplication(
-            self.source.auth_dict['client_id'],
-            authority=f"https://login.microsoftonline.com/{self.source.auth_dict['tenant_id']}",
-            client_credential=self.source.auth_dict['client_secret'],
-        )
-        result = app.acquire_token_silent(["https://graph.microsoft.com/.default"], account=None)
-        if not result:
-            result = app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
-        if "access_token" in result:
-            return result["access_token"]
-        else:
-            raise Exception(f"Error acquiring token: {result.get('error')}")
+        auth_dict = self.source.auth_dict
+        return get_graph_token(auth_dict['tenant_id'], auth_dict['client_id'], auth_dict['client_secret'])
 
     def fetch_events(self):
-        headers = {
+        session = instrumented_session()
+        session.headers = {
             'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
-        url = f"https://graph.microsoft.com/v1.0/users/{self.source.auth_dict['email']}/messages"
-        params = {
-            '$select': 'subject,receivedDateTime,bodyPreview,from,toRecipients,ccRecipients',
-            '$orderby': 'receivedDateTime DESC',
-            '$top': 50  # Adjust this value based on how many emails you want to fetch at once
+            'Content-Type': 'application/json',
+            'Prefer': f'odata.maxpagesize={self.page_size}'
         }
+        for folder in self.source.auth_dict.get('folders', self.default_folders):
+            self.fetch_folder(session, folder)
+
+    def fetch_folder(self, session, folder):
+        checkpoint = dict(self.checkpoint or {})
+        initial_url = f"{self.graph_url}/users/{self.source.auth_dict['email']}/mailFolders/{folder}/messages/delta"
+        initial_params = {'$select': 'subject,receivedDateTime,bodyPreview,from,toRecipients,ccRecipients'}
+        url = checkpoint.get(folder) or self.source.delta_links.get(folder)
+        params = {}
+        if not url:
+            url, params = initial_url, initial_params
         while url:
-            response = requests.get(url, headers=headers, params=params)
+            response = session.get(url, params=params)
+            # Graph expires or invalidates delta state (syncStateNotFound, resyncRequired), and the only way
+            # back is a fresh delta sync; messages seen before are dropped again as duplicates
+            if response.status_code == 410 and url != initial_url:
+                print(f'Delta sync state for {folder} of {self.source} is gone, restarting it')
+                checkpoint.pop(folder, None)
+                self.source.delta_links.pop(folder, None)
+                self.set_checkpoint(checkpoint or None)
+                url, params = initial_url, initial_params
+                continue
             response.raise_for_status()
             data = response.json()
             for email in data['value']:
+                if '@removed' in email:
+                    continue
                 try:
                     from_email = email['from']['emailAddress']['address']
                     to_emails = [recipient['emailAddress']['address'] for recipient in email['toRecipients']]
@@ -128,6 +283,18 @@ class OutlookImporter(BaseImporter):
                     print(f'Error saving email: {e}')
             url = data.get('@odata.nextLink')
             params = {}
+            if url:
+                checkpoint[folder] = url
+            else:
+                checkpoint.pop(folder, None)
+                self.pending_delta_links[folder] = data['@odata.deltaLink']
+            self.set_checkpoint(checkpoint or None)
+
+    def flush(self):
+        # The delta link is only persisted together with the events that came before it
+        self.source.delta_links.update(self.pending_delta_links)
+        self.pending_delta_links = {}
+        super().flush()
 
 
 def get_importer(source) -> BaseImporter:
@@ -0,0 +1,184 @@
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+
+from utils import LazyImport
+
+requests = LazyImport('requests')
+
+logger = logging.getLogger(__name__)
+
+current = ContextVar('instrumentation_metrics', default=None)
+running_tasks = {}
+
+COUNTERS = ['count', 'errors', 'seconds', 'db_queries', 'db_seconds', 'http_calls', 'http_seconds', 'cache_hits',
+            'cache_misses']
+totals = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+totals_lock = threading.Lock()
+
+
+class Metrics:
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.error = False
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.http_calls = 0
+        self.http_seconds = 0.0
+        self.http_hosts = defaultdict(int)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.started = time.perf_counter()
+        # Worker threads started with in_current_context add to the same counters
+        self.lock = threading.Lock()
+        self.query_wrapper = connection.execute_wrapper(self.record_query)
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self.lock:
+                self.db_queries += 1
+                self.db_seconds += time.perf_counter() - started
+
+    def as_dict(self):
+        return {
+            'kind': self.kind,
+            'name': self.name,
+            'error': self.error,
+            'seconds': round(time.perf_counter() - self.started, 4),
+            'db_queries': self.db_queries,
+            'db_seconds': round(self.db_seconds, 4),
+            'http_calls': self.http_calls,
+            'http_seconds': round(self.http_seconds, 4),
+            'http_hosts': dict(self.http_hosts),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+
+def start(kind, name):
+    if not settings.INSTRUMENTATION_ENABLED or random.random() >= settings.INSTRUMENTATION_SAMPLE_RATE:
+        return None
+    metrics = Metrics(kind, name)
+    metrics.token = current.set(metrics)
+    metrics.query_wrapper.__enter__()
+    return metrics
+
+
+def finish(metrics):
+    metrics.query_wrapper.__exit__(None, None, None)
+    current.reset(metrics.token)
+    record = metrics.as_dict()
+    with totals_lock:
+        counters = totals[(metrics.kind, metrics.name)]
+        counters['count'] += 1
+        counters['errors'] += metrics.error
+        for counter in COUNTERS[2:]:
+            counters[counter] += record[counter]
+    logger.info(json.dumps(record))
+    return record
+
+
+@contextmanager
+def track(kind, name):
+    metrics = start(kind, name)
+    try:
+        yield metrics
+    except Exception:
+        if metrics:
+            metrics.error = True
+        raise
+    finally:
+        if metrics:
+            finish(metrics)
+
+
+def record_cache(hit):
+    metrics = current.get()
+    if metrics:
+        with metrics.lock:
+            if hit:
+                metrics.cache_hits += 1
+            else:
+                metrics.cache_misses += 1
+
+
+def record_response(response, *args, **kwargs):
+    metrics = current.get()
+    if metrics:
+        with metrics.lock:
+            metrics.http_calls += 1
+            metrics.http_seconds += response.elapsed.total_seconds()
+            metrics.http_hosts[urlparse(response.url).hostname] += 1
+
+
+def in_current_context(function):
+    # Executor threads start with an empty context, so calls made from them would go unrecorded
+    context = copy_context()
+    return lambda *args: context.copy().run(function, *args)
+
+
+def instrumented_session():
+    session = requests.session()
+    session.hooks['response'].append(record_response)
+    return session
+
+
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with track('request', request.path) as metrics:
+            response = self.get_response(request)
+            if metrics:
+                # Group by URL pattern rather than path so metrics don't grow with every project and month
+                match = request.resolver_match
+                metrics.name = f'{request.method} {match.route if match else "unmatched"}'
+                metrics.error = response.status_code >= 500
+        return response
+
+
+# Connected to the Celery task signals in project.tasks
+def start_task(task_id=None, task=None, **kwargs):
+    metrics = start('task', task.name)
+    if metrics:
+        running_tasks[task_id] = metrics
+
+
+def finish_task(task_id=None, state=None, **kwargs):
+    metrics = running_tasks.pop(task_id, None)
+    if metrics:
+        metrics.error = state == 'FAILURE'
+        finish(metrics)
+
+
+# Totals are kept per process, so each web and worker process reports its own counts since it started. Scrape
+# every process, or sum the per-request log lines, for deployment-wide figures
+def metrics_view(request):
+    token = settings.INSTRUMENTATION_METRICS_TOKEN
+    if not request.user.is_staff and not (token and request.headers.get('Authorization') == f'Bearer {token}'):
+        return HttpResponseForbidden()
+    lines = []
+    with totals_lock:
+        snapshot = {key: dict(counters) for key, counters in totals.items()}
+    for counter in COUNTERS:
+        name = f'logsheet_{counter}_total'
+        lines.append(f'# TYPE {name} counter')
+        for (kind, label), counters in sorted(snapshot.items()):
+            label = label.replace('\\', '\\\\').replace('"', '\\"')
+            lines.append(f'{name}{{kind="{kind}",name="{label}"}} {counters[counter]}')
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4')
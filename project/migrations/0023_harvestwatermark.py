@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0022_timeentry_billable'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HarvestWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource', models.CharField(max_length=50, unique=True)),
+                ('updated_since', models.DateTimeField(blank=True, null=True)),
+                ('last_full_sync', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
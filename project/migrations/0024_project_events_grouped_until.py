@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0023_harvestwatermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='events_grouped_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
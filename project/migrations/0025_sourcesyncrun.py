@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0024_project_events_grouped_until'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SourceSyncRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('duration', models.DurationField(blank=True, null=True)),
+                ('event_count', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='project.source')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0025_sourcesyncrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='checkpoint',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0026_source_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='delta_links',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0027_source_delta_links'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventblock',
+            name='graph_event_id',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
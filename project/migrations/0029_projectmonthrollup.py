@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:48
+
+import datetime
+import django.db.models.deletion
+from django.db import migrations, models
+
+BACKFILL_ROLLUPS = '''
+INSERT INTO project_projectmonthrollup (
+    project_id, month, hours, billable_hours, non_billable_hours,
+    cumulative_hours, cumulative_billable_hours, updated_at
+)
+SELECT project_id, month, hours, billable_hours, hours - billable_hours,
+       SUM(hours) OVER project_months, SUM(billable_hours) OVER project_months, now()
+FROM (
+    SELECT project_id, date_trunc('month', date)::date AS month, SUM(hours) AS hours,
+           COALESCE(SUM(hours) FILTER (WHERE billable), interval '0') AS billable_hours
+    FROM project_timeentry
+    GROUP BY 1, 2
+) AS months
+WINDOW project_months AS (PARTITION BY project_id ORDER BY month)
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0028_eventblock_graph_event_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectMonthRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('hours', models.DurationField(default=datetime.timedelta)),
+                ('billable_hours', models.DurationField(default=datetime.timedelta)),
+                ('non_billable_hours', models.DurationField(default=datetime.timedelta)),
+                ('cumulative_hours', models.DurationField(default=datetime.timedelta)),
+                ('cumulative_billable_hours', models.DurationField(default=datetime.timedelta)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='project.project')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('project', 'month'), name='unique_project_month_rollup')],
+            },
+        ),
+        migrations.RunSQL(BACKFILL_ROLLUPS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+# Events arrive in the thousands per day at most, so month-sized chunks keep the chunk count low while
+# a single chunk's indexes still fit comfortably in memory
+CHUNK_INTERVAL = '30 days'
+COMPRESS_AFTER = '90 days'
+
+CREATE_HYPERTABLE = [
+    'CREATE EXTENSION IF NOT EXISTS timescaledb',
+    # Unique indexes on a hypertable must include the partitioning column; unique_event already does
+    'ALTER TABLE project_event DROP CONSTRAINT project_event_pkey',
+    'ALTER TABLE project_event ADD PRIMARY KEY (id, timestamp)',
+    f"SELECT create_hypertable('project_event', 'timestamp', chunk_time_interval => INTERVAL '{CHUNK_INTERVAL}', "
+    "migrate_data => true)",
+    "ALTER TABLE project_event SET (timescaledb.compress, timescaledb.compress_segmentby = 'source_id', "
+    "timescaledb.compress_orderby = 'timestamp DESC')",
+    f"SELECT add_compression_policy('project_event', INTERVAL '{COMPRESS_AFTER}', if_not_exists => true)",
+]
+
+
+def create_hypertable(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb'")
+        if cursor.fetchone() is None:
+            print('TimescaleDB is not available, leaving project_event as a plain table')
+            return
+    for statement in CREATE_HYPERTABLE:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0029_projectmonthrollup'),
+    ]
+
+    # A hypertable can't be turned back into a plain table in place, so reversing leaves it as is
+    operations = [
+        migrations.RunPython(create_hypertable, migrations.RunPython.noop),
+    ]
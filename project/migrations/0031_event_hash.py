@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+BACKFILL_EVENT_HASHES = '''
+UPDATE project_event
+SET event_hash = encode(sha256(convert_to(event_text, 'UTF8')), 'hex')
+WHERE event_hash = ''
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0030_event_hypertable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='event_hash',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunSQL(BACKFILL_EVENT_HASHES, migrations.RunSQL.noop),
+        migrations.RemoveConstraint(
+            model_name='event',
+            name='unique_event',
+        ),
+        migrations.AddConstraint(
+            model_name='event',
+            constraint=models.UniqueConstraint(fields=('source', 'timestamp', 'event_hash'), name='unique_event_hash'),
+        ),
+    ]
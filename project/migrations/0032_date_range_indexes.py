@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:09
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without locking writes from syncs
+    atomic = False
+
+    dependencies = [
+        ('project', '0031_event_hash'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='eventblock',
+            index=models.Index(fields=['project', 'start_timestamp'], include=('end_timestamp',), name='eventblock_project_start'),
+        ),
+        AddIndexConcurrently(
+            model_name='projectdaysummary',
+            index=models.Index(fields=['project', 'date'], name='daysummary_project_date'),
+        ),
+        AddIndexConcurrently(
+            model_name='timeentry',
+            index=models.Index(fields=['project', 'date'], include=('hours', 'billable'), name='timeentry_project_date'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0032_date_range_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('modified_at', models.DateTimeField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('imported_at', models.DateTimeField(auto_now=True)),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='project.source')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('source', 'path'), name='unique_imported_file')],
+            },
+        ),
+    ]
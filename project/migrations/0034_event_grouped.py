@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+# Existing rows take the column default, so only events the watermark hasn't reached yet are rewritten
+UNGROUP_EVENTS_AFTER_WATERMARK = '''
+UPDATE project_event SET grouped = false
+FROM project_source, project_project
+WHERE project_event.source_id = project_source.id
+  AND project_source.project_id = project_project.id
+  AND project_event.created_at > project_project.events_grouped_until
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0033_importedfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='grouped',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='grouped',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunSQL(UNGROUP_EVENTS_AFTER_WATERMARK, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('grouped', False)), fields=['source'], name='event_ungrouped'),
+        ),
+    ]
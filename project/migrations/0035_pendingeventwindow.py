@@ -0,0 +1,40 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Events still waiting for grouping become one window per project before the flag goes away
+QUEUE_UNGROUPED_EVENTS = '''
+INSERT INTO project_pendingeventwindow (project_id, start_timestamp, end_timestamp)
+SELECT project_source.project_id, min(project_event.timestamp), max(project_event.timestamp)
+FROM project_event
+JOIN project_source ON project_source.id = project_event.source_id
+WHERE NOT project_event.grouped AND project_source.project_id IS NOT NULL
+GROUP BY project_source.project_id
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0034_event_grouped'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingEventWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_timestamp', models.DateTimeField()),
+                ('end_timestamp', models.DateTimeField()),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='project.project')),
+            ],
+        ),
+        migrations.RunSQL(QUEUE_UNGROUPED_EVENTS, migrations.RunSQL.noop),
+        migrations.RemoveIndex(
+            model_name='event',
+            name='event_ungrouped',
+        ),
+        migrations.RemoveField(
+            model_name='event',
+            name='grouped',
+        ),
+    ]
@@ -1,11 +1,17 @@
+import hashlib
 import re
 
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
-from django.db import models
+from django.core.cache import cache
+from django.db import connection, models, transaction
+from django.db.models.functions import TruncDate, TruncMonth
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
 from project.importers import get_importer
+from project.instrumentation import record_cache
 from .calendar import AzureCalendarExport
 
 
@@ -32,16 +38,115 @@ class Project(models.Model):
     project_start_date = models.DateField(null=True, blank=True)
     total_duration = models.DurationField(null=True, blank=True)
     harvest_id = models.CharField(max_length=255, null=True, blank=True)
+    events_grouped_until = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.name
 
-    def group_event_blocks(self):
-        event_block = EventBlock()
-        for event in Event.objects.filter(source__project=self).order_by('timestamp'):
-            if not event_block.check_add_event(event):
-                event_block.save()
-                event_block = EventBlock()
+    def group_event_blocks(self, full=False, batch_size=1000):
+        events = Event.objects.filter(source__project=self)
+        full = full or not self.events_grouped_until
+        with transaction.atomic():
+            grouped_at = timezone.now()
+            pending_windows = self.claim_pending_windows()
+            if full:
+                self.rebuild_event_blocks(events, self.eventblock_set.all(), batch_size)
+            elif not pending_windows:
+                return
+            else:
+                for window_start, window_end in self.event_windows(pending_windows):
+                    self.regroup_event_window(window_start, window_end, batch_size)
+            self.events_grouped_until = grouped_at
+            self.save(update_fields=['events_grouped_until'])
+
+    def claim_pending_windows(self):
+        # Windows are queued in the same transaction as their events, so unlike a created_at watermark this
+        # picks up imports that committed late; anything committed after this statement waits for the next run
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                DELETE FROM {PendingEventWindow._meta.db_table} WHERE project_id = %s
+                RETURNING start_timestamp, end_timestamp
+            ''', [self.pk])
+            return sorted(cursor.fetchall())
+
+    @staticmethod
+    def grouping_gap():
+        return timezone.timedelta(
+            minutes=settings.TIMESHEET['minimum_task_minutes'] + settings.TIMESHEET['time_on_task_minutes'])
+
+    @classmethod
+    def event_windows(cls, spans):
+        # Merges (start, end) spans sorted by start that lie within the grouping gap of each other
+        gap = cls.grouping_gap()
+        window_start = window_end = None
+        for start, end in spans:
+            if window_end and start - window_end > gap:
+                yield window_start, window_end
+                window_start = window_end = None
+            window_start = window_start or start
+            window_end = max(window_end or end, end)
+        if window_start:
+            yield window_start, window_end
+
+    def regroup_event_window(self, window_start, window_end, batch_size=1000):
+        gap = self.grouping_gap()
+        touching = self.eventblock_set.filter(
+            start_timestamp__lte=window_end + gap, end_timestamp__gte=window_start - gap)
+        bounds = touching.aggregate(models.Min('start_timestamp'), models.Max('end_timestamp'))
+        window_start = min(filter(None, [window_start, bounds['start_timestamp__min']]))
+        window_end = max(filter(None, [window_end, bounds['end_timestamp__max']]))
+        self.rebuild_event_blocks(Event.objects.filter(
+            source__project=self, timestamp__gte=window_start, timestamp__lte=window_end), touching, batch_size)
+
+    def build_event_blocks(self, events, batch_size=1000):
+        timestamps = events.order_by('timestamp').values_list('timestamp', flat=True).iterator(chunk_size=batch_size)
+        event_block = EventBlock(project=self)
+        for timestamp in timestamps:
+            if not event_block.check_add_timestamp(timestamp):
+                yield event_block
+                event_block = EventBlock(project=self)
+                event_block.add_timestamp(timestamp)
+        if event_block.start_timestamp:
+            yield event_block
+
+    def rebuild_event_blocks(self, events, old_blocks, batch_size=1000):
+        # Regrouping only merges and extends blocks, so each old block starts inside the block that replaces
+        # it. The first old block inside a new one is updated in place, which keeps its summary and calendar
+        # event so the calendar sync patches it instead of recreating it
+        old_blocks = old_blocks.order_by('start_timestamp').iterator(chunk_size=batch_size)
+        old_block = next(old_blocks, None)
+        created, updated, deleted = [], [], []
+        for event_block in self.build_event_blocks(events, batch_size):
+            kept = None
+            while old_block and old_block.start_timestamp <= event_block.end_timestamp:
+                if kept or old_block.start_timestamp < event_block.start_timestamp:
+                    deleted.append(old_block.pk)
+                else:
+                    kept = old_block
+                old_block = next(old_blocks, None)
+            if kept is None:
+                created.append(event_block)
+            elif (kept.start_timestamp, kept.end_timestamp) != (event_block.start_timestamp,
+                                                                event_block.end_timestamp):
+                kept.start_timestamp = event_block.start_timestamp
+                kept.end_timestamp = event_block.end_timestamp
+                updated.append(kept)
+            if len(created) + len(updated) + len(deleted) >= batch_size:
+                self.save_event_blocks(created, updated, deleted)
+                created, updated, deleted = [], [], []
+        while old_block:
+            deleted.append(old_block.pk)
+            old_block = next(old_blocks, None)
+        self.save_event_blocks(created, updated, deleted)
+
+    @staticmethod
+    def save_event_blocks(created, updated, deleted):
+        if deleted:
+            EventBlock.objects.filter(pk__in=deleted).delete()
+        if updated:
+            EventBlock.objects.bulk_update(updated, ['start_timestamp', 'end_timestamp'])
+        if created:
+            EventBlock.objects.bulk_create(created)
 
     def total_seconds(self):
         return sum(event_block.duration().total_seconds() for event_block in self.eventblock_set.all())
@@ -49,16 +154,41 @@ class Project(models.Model):
     def total_hours(self):
         return self.total_seconds() / 3600
 
-    def carried_over_duration(self, month_start):
+    def months_since_start(self, month_start):
+        start_date = self.project_start_date
+        months = (month_start.year - start_date.year) * 12 + month_start.month - start_date.month
+        # A date past the first of its month also counts the month it falls in
+        if month_start.day > 1:
+            months += 1
+        return max(months, 0)
+
+    def carried_over_duration(self, month_start, billable_before=None):
         if not self.project_start_date or not self.monthly_duration:
             return timezone.timedelta()
-        start_date = self.project_start_date.replace(day=1)
-        current_date = start_date
-        months_since_start = 0
-        while current_date < month_start:
-            months_since_start += 1
-            current_date += relativedelta(months=1)
-        return self.billable_duration_before_time(month_start) - (self.monthly_duration * months_since_start)
+        if billable_before is None:
+            billable_before = self.billable_duration_before_time(month_start)
+        return billable_before - (self.monthly_duration * self.months_since_start(month_start))
+
+    def carryover_by_month(self, until=None):
+        if not self.project_start_date or not self.monthly_duration:
+            return {}
+        if until is None:
+            until = timezone.now().astimezone(settings.AS_LOCAL_TIME_ZONE).date()
+        billable_by_month = dict(
+            self.timeentry_set.filter(billable=True, date__lt=until.replace(day=1))
+            .annotate(month=TruncMonth('date')).values('month')
+            .annotate(hours=models.Sum('hours')).values_list('month', 'hours')
+        )
+        first_month = min([self.project_start_date.replace(day=1), *billable_by_month])
+        months = (until.year - first_month.year) * 12 + until.month - first_month.month
+
+        carryover = {}
+        billable_before = timezone.timedelta()
+        for offset in range(months + 1):
+            month_start = first_month + relativedelta(months=offset)
+            carryover[month_start] = self.carried_over_duration(month_start, billable_before)
+            billable_before += billable_by_month.get(month_start, timezone.timedelta())
+        return carryover
 
     def duration_before_time(self, timestamp):
         return self.timeentry_set.filter(date__lt=timestamp).aggregate(models.Sum('hours'))['hours__sum'] or timezone.timedelta()
@@ -70,7 +200,9 @@ class Project(models.Model):
         return self.events_in_month(month, year).aggregate(models.Sum('hours'))['hours__sum']
 
     def events_in_month(self, month, year):
-        return self.timeentry_set.filter(date__month=month, date__year=year).order_by('-date')
+        month_start = timezone.datetime(year, month, 1).date()
+        return self.timeentry_set.filter(
+            date__gte=month_start, date__lt=month_start + relativedelta(months=1)).order_by('-date')
 
     def total_time_delta(self):
         return self.timeentry_set.aggregate(models.Sum('hours'))['hours__sum']
@@ -84,8 +216,8 @@ class Project(models.Model):
             event_block.summarise()
 
     def days_with_events(self):
-        return {event.timestamp.astimezone(settings.AS_LOCAL_TIME_ZONE).date()
-                for event in Event.objects.filter(source__project=self)}
+        return set(Event.objects.filter(source__project=self).annotate(
+            day=TruncDate('timestamp', tzinfo=settings.AS_LOCAL_TIME_ZONE)).values_list('day', flat=True).distinct())
 
     def create_days(self):
         for day in self.days_with_events():
@@ -100,8 +232,13 @@ class Project(models.Model):
             day.add_to_harvest()
 
     def add_all_to_calendar(self):
-        for event_block in self.eventblock_set.filter(uploaded_to_calendar=False).order_by('-start_timestamp'):
-            event_block.add_to_calendar()
+        event_blocks = self.eventblock_set.filter(uploaded_to_calendar=False).order_by('-start_timestamp')
+        uploaded = AzureCalendarExport().add_event_blocks(event_blocks)
+        for event_block, calendar_event in uploaded.items():
+            event_block.uploaded_to_calendar = True
+            event_block.graph_event_id = calendar_event['id']
+        EventBlock.objects.bulk_update(uploaded, ['uploaded_to_calendar', 'graph_event_id'], batch_size=1000)
+        print(f'Added {len(uploaded)} event blocks for {self} to calendar')
 
 
 class TimeEntry(models.Model):
@@ -112,9 +249,109 @@ class TimeEntry(models.Model):
     harvest_id = models.CharField(max_length=255, unique=True)
     billable = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Covers the per-project hour totals so they can be answered from the index alone
+            models.Index(fields=['project', 'date'], include=['hours', 'billable'], name='timeentry_project_date'),
+        ]
+
     def __str__(self):
         return f"{self.project} - {self.date} - {self.hours}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so saving an entry that moved also refreshes the month it left
+        instance.loaded_project_date = (instance.__dict__.get('project_id'), instance.__dict__.get('date'))
+        return instance
+
+
+@receiver([post_save, post_delete], sender=TimeEntry)
+def refresh_month_rollups(sender, instance, origin=None, **kwargs):
+    # Deleting a client or project removes the rollups along with the entries. Harvest syncs write in bulk
+    # without signals and refresh the rollups themselves
+    if origin is not None and getattr(origin, 'model', type(origin)) is not TimeEntry:
+        return
+    changed_dates = {instance.project_id: instance.date}
+    project_id, date = getattr(instance, 'loaded_project_date', (None, None))
+    if project_id and date:
+        changed_dates[project_id] = min(date, changed_dates.get(project_id, date))
+    ProjectMonthRollup.refresh_projects(changed_dates)
+    instance.loaded_project_date = (instance.project_id, instance.date)
+
+
+class HarvestWatermark(models.Model):
+    resource = models.CharField(max_length=50, unique=True)
+    updated_since = models.DateTimeField(null=True, blank=True)
+    last_full_sync = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.resource} - {self.updated_since}'
+
+
+class ProjectMonthRollup(models.Model):
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    month = models.DateField()
+    hours = models.DurationField(default=timezone.timedelta)
+    billable_hours = models.DurationField(default=timezone.timedelta)
+    non_billable_hours = models.DurationField(default=timezone.timedelta)
+    cumulative_hours = models.DurationField(default=timezone.timedelta)
+    cumulative_billable_hours = models.DurationField(default=timezone.timedelta)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'month'], name='unique_project_month_rollup')
+        ]
+
+    def __str__(self):
+        return f'{self.project_id} - {self.month:%Y-%m} - {self.hours}'
+
+    @classmethod
+    def before(cls, project, month_start):
+        return cls.objects.filter(project=project, month__lt=month_start).order_by('-month').first()
+
+    @classmethod
+    def refresh(cls, project_id, since):
+        since = since.replace(day=1)
+        previous = cls.objects.filter(project_id=project_id, month__lt=since).order_by('-month').first()
+        cumulative = previous.cumulative_hours if previous else timezone.timedelta()
+        cumulative_billable = previous.cumulative_billable_hours if previous else timezone.timedelta()
+        totals = {total['month']: total for total in TimeEntry.objects.filter(
+            project_id=project_id, date__gte=since
+        ).annotate(month=TruncMonth('date')).values('month').annotate(
+            total_hours=models.Sum('hours'),
+            total_billable_hours=models.Sum('hours', filter=models.Q(billable=True)),
+        ).order_by('month')}
+
+        rollups = []
+        month = since
+        # Months without entries after a change still get a row, so later months' versions move with it
+        while month <= max(totals, default=since):
+            total = totals.get(month, {})
+            hours = total.get('total_hours') or timezone.timedelta()
+            billable_hours = total.get('total_billable_hours') or timezone.timedelta()
+            cumulative += hours
+            cumulative_billable += billable_hours
+            rollups.append(cls(
+                project_id=project_id,
+                month=month,
+                hours=hours,
+                billable_hours=billable_hours,
+                non_billable_hours=hours - billable_hours,
+                cumulative_hours=cumulative,
+                cumulative_billable_hours=cumulative_billable,
+            ))
+            month += relativedelta(months=1)
+        with transaction.atomic():
+            cls.objects.filter(project_id=project_id, month__gte=since).delete()
+            cls.objects.bulk_create(rollups)
+
+    @classmethod
+    def refresh_projects(cls, changed_dates):
+        for project_id, since in changed_dates.items():
+            cls.refresh(project_id, since)
+
 
 class Source(models.Model):
     SOURCE_TYPES = [
@@ -132,15 +369,70 @@ class Source(models.Model):
     base_url = models.URLField(blank=True, null=True)
     project = models.ForeignKey(Project, on_delete=models.CASCADE, null=True)
     last_sync = models.DateTimeField(null=True, blank=True)
+    checkpoint = models.JSONField(null=True, blank=True)
+    delta_links = models.JSONField(default=dict, blank=True)
     enabled = models.BooleanField(default=True)
 
     def __str__(self):
         return f'{self.source_type} - {self.project}'
 
+    # Rule changes made with QuerySet.update() or bulk_create() skip the eviction signals, so cached matchers
+    # are also rebuilt once this expires
+    rule_matcher_timeout = 3600
+
+    @staticmethod
+    def rule_matcher_cache_key(source_id):
+        # Versioned so pickles of an older SourceRuleMatcher aren't loaded after a deploy that changes it
+        return f'source-rule-matcher:{SourceRuleMatcher.version}:{source_id}'
+
+    def rule_matcher(self):
+        matcher = cache.get(self.rule_matcher_cache_key(self.pk))
+        record_cache(matcher is not None)
+        if matcher is None:
+            matcher = SourceRuleMatcher(self.sourcerule_set.values_list('rule_type', 'rule'))
+            cache.set(self.rule_matcher_cache_key(self.pk), matcher, timeout=self.rule_matcher_timeout)
+        return matcher
+
     def sync(self):
-        importer = get_importer(self)
-        importer.sync()
-        print(f'Synced {self.source_type} for {self.project}')
+        run = SourceSyncRun(source=self, started_at=timezone.now())
+        try:
+            run.event_count = get_importer(self).sync()
+        except Exception as e:
+            run.error = str(e)
+            raise
+        finally:
+            run.duration = timezone.now() - run.started_at
+            run.save()
+        print(f'Synced {self.source_type} for {self.project}: {run.event_count} events in {run.duration}')
+        return run
+
+
+class SourceSyncRun(models.Model):
+    source = models.ForeignKey(Source, on_delete=models.CASCADE)
+    started_at = models.DateTimeField()
+    duration = models.DurationField(null=True, blank=True)
+    event_count = models.IntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.source} - {self.started_at}'
+
+
+class ImportedFile(models.Model):
+    source = models.ForeignKey(Source, on_delete=models.CASCADE)
+    path = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    modified_at = models.DateTimeField()
+    content_hash = models.CharField(max_length=64)
+    imported_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'path'], name='unique_imported_file')
+        ]
+
+    def __str__(self):
+        return f'{self.source} - {self.path}'
 
 
 class SourceRule(models.Model):
@@ -174,17 +466,93 @@ class SourceRule(models.Model):
             return bool(re.match(self.rule, event_text))
 
 
+@receiver([post_save, post_delete], sender=SourceRule)
+def invalidate_rule_matcher(sender, instance, **kwargs):
+    cache.delete(Source.rule_matcher_cache_key(instance.source_id))
+
+
+class SourceRuleMatcher:
+    # Bump when the attributes change, as instances are pickled into the cache
+    version = 1
+
+    def __init__(self, rules):
+        exact, prefixes, suffixes, contains, patterns = set(), [], [], [], []
+        for rule_type, rule in rules:
+            if rule_type == SourceRule.EXACT:
+                exact.add(rule)
+            elif rule_type == SourceRule.STARTS_WITH:
+                prefixes.append(rule)
+            elif rule_type == SourceRule.END_WITH:
+                suffixes.append(rule)
+            elif rule_type == SourceRule.CONTAINS:
+                contains.append(rule)
+            elif rule_type == SourceRule.REGEX:
+                patterns.append(re.compile(rule))
+        self.exact = frozenset(exact)
+        self.prefixes = tuple(prefixes)
+        self.suffixes = tuple(suffixes)
+        self.contains = re.compile('|'.join(map(re.escape, contains))) if contains else None
+        self.patterns = patterns
+
+    def match(self, event_text):
+        return (
+            event_text in self.exact
+            or event_text.startswith(self.prefixes)
+            or event_text.endswith(self.suffixes)
+            or bool(self.contains and self.contains.search(event_text))
+            or any(pattern.match(event_text) for pattern in self.patterns)
+        )
+
+
 class Event(models.Model):
     timestamp = models.DateTimeField()
     source = models.ForeignKey(Source, on_delete=models.CASCADE)
     event_text = models.TextField()
+    event_hash = models.CharField(max_length=64)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         constraints = [
-            models.UniqueConstraint(fields=['timestamp', 'source', 'event_text'], name='unique_event')
+            models.UniqueConstraint(fields=['source', 'timestamp', 'event_hash'], name='unique_event_hash')
         ]
 
+    @staticmethod
+    def hash_text(event_text):
+        # Matches encode(sha256(convert_to(event_text, 'UTF8')), 'hex') used by the backfill migration
+        return hashlib.sha256(event_text.encode()).hexdigest()
+
+    def save(self, *args, **kwargs):
+        if not self.event_hash:
+            self.event_hash = self.hash_text(self.event_text)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.queue_grouping(self.source.project_id, [self.timestamp])
+
+    @staticmethod
+    def queue_grouping(project_id, timestamps):
+        # Called with every batch of new events; bulk_create alone leaves them out of incremental grouping
+        if not project_id or not timestamps:
+            return
+        parsed = []
+        for timestamp in timestamps:
+            timestamp = models.DateTimeField().to_python(timestamp)
+            parsed.append(timezone.make_aware(timestamp) if timezone.is_naive(timestamp) else timestamp)
+        PendingEventWindow.objects.bulk_create([
+            PendingEventWindow(project_id=project_id, start_timestamp=start, end_timestamp=end)
+            for start, end in Project.event_windows((timestamp, timestamp) for timestamp in sorted(parsed))
+        ])
+
+
+class PendingEventWindow(models.Model):
+    # Time ranges with events not yet grouped into blocks. Kept apart from the events so grouping never has
+    # to update the event hypertable, whose older chunks are compressed
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    start_timestamp = models.DateTimeField()
+    end_timestamp = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.project_id} - {self.start_timestamp} to {self.end_timestamp}'
+
 
 class ProjectDaySummary(models.Model):
     summary = models.TextField(null=True)
@@ -192,6 +560,11 @@ class ProjectDaySummary(models.Model):
     date = models.DateField()
     uploaded_to_harvest = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', 'date'], name='daysummary_project_date'),
+        ]
+
     @property
     def start_timestamp(self):
         return timezone.datetime.combine(
@@ -202,9 +575,14 @@ class ProjectDaySummary(models.Model):
         return timezone.datetime.combine(
             self.date, timezone.datetime.max.time()).astimezone(settings.AS_LOCAL_TIME_ZONE)
 
+    @property
+    def next_day_timestamp(self):
+        return self.start_timestamp + timezone.timedelta(days=1)
+
     def event_blocks(self):
         return EventBlock.objects.filter(
-            start_timestamp__range=[self.start_timestamp, self.end_timestamp],
+            start_timestamp__gte=self.start_timestamp,
+            start_timestamp__lt=self.next_day_timestamp,
             project=self.project
         ).order_by('start_timestamp')
 
@@ -213,7 +591,8 @@ class ProjectDaySummary(models.Model):
 
     def events(self):
         return Event.objects.filter(
-            timestamp__range=[self.start_timestamp, self.end_timestamp],
+            timestamp__gte=self.start_timestamp,
+            timestamp__lt=self.next_day_timestamp,
             source__project=self.project
         ).order_by('timestamp')
 
@@ -233,6 +612,13 @@ class EventBlock(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE, null=True)
     summary = models.TextField(null=True)
     uploaded_to_calendar = models.BooleanField(default=False)
+    graph_event_id = models.CharField(max_length=255, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', 'start_timestamp'], include=['end_timestamp'],
+                         name='eventblock_project_start'),
+        ]
 
     @property
     def tz_start_timestamp(self):
@@ -257,21 +643,29 @@ class EventBlock(models.Model):
             return None
 
     def add_event(self, event):
-        if not self.start_timestamp:
-            self.start_timestamp = event.timestamp
-        if not self.project:
+        if not self.project_id:
             self.project = event.source.project
+        self.add_timestamp(event.timestamp)
+
+    def add_timestamp(self, timestamp):
+        if not self.start_timestamp:
+            self.start_timestamp = timestamp
         if not self.end_timestamp:
-            self.end_timestamp = event.timestamp + timezone.timedelta(
+            self.end_timestamp = timestamp + timezone.timedelta(
                 minutes=settings.TIMESHEET['minimum_task_minutes'])
         else:
-            self.end_timestamp = event.timestamp
+            self.end_timestamp = timestamp
 
     def check_add_event(self, event):
         if not self.task_end_time or event.timestamp < self.task_end_time:
             self.add_event(event)
             return True
 
+    def check_add_timestamp(self, timestamp):
+        if not self.task_end_time or timestamp < self.task_end_time:
+            self.add_timestamp(timestamp)
+            return True
+
     def events(self):
         return Event.objects.filter(
             timestamp__range=[self.start_timestamp, self.end_timestamp],
@@ -282,7 +676,16 @@ class EventBlock(models.Model):
         return '\n'.join([f'{event.source.source_type}: {event.event_text}' for event in self.events()])
 
     def add_to_calendar(self):
-        AzureCalendarExport().add_event_block(self)
+        self.graph_event_id = AzureCalendarExport().add_event_block(self)['id']
         self.uploaded_to_calendar = True
         self.save()
         print(f'Added to {self} calendar')
+
+    @classmethod
+    def sync_calendar(cls):
+        event_blocks = cls.objects.only('start_timestamp', 'end_timestamp', 'summary', 'graph_event_id')
+        created, counts = AzureCalendarExport().sync_event_blocks(event_blocks)
+        cls.objects.bulk_update(created, ['graph_event_id', 'uploaded_to_calendar'], batch_size=1000)
+        print(f"Synced calendar: {counts['created']} created, {counts['updated']} updated, "
+              f"{counts['deleted']} deleted")
+        return counts
@@ -0,0 +1,24 @@
+from rest_framework import serializers
+
+from . import models
+
+
+class ProjectSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Project
+        fields = ['id', 'name', 'client', 'project_start_date', 'monthly_duration', 'total_duration', 'harvest_id']
+
+
+class MonthlySummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.ProjectMonthRollup
+        fields = [
+            'id', 'project', 'month', 'hours', 'billable_hours', 'non_billable_hours', 'cumulative_hours',
+            'cumulative_billable_hours'
+        ]
+
+
+class TimeEntrySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.TimeEntry
+        fields = ['id', 'project', 'date', 'hours', 'notes', 'billable', 'harvest_id']
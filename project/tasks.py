@@ -0,0 +1,58 @@
+from celery import shared_task
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.core.cache import cache
+
+from project import instrumentation
+from project.models import Source
+
+SYNC_SOURCE_TASK = 'project.tasks.sync_source'
+
+# Connected where the tasks are defined, so any process that can run them is instrumented whether or not
+# it loaded the Celery app in logsheet.celery
+task_prerun.connect(instrumentation.start_task)
+task_postrun.connect(instrumentation.finish_task)
+
+
+def acquire_provider_slot(source_type):
+    # One key per slot, each taken with its own expiry like the source lock, so a holder that outlives
+    # the timeout or dies only frees its own slot instead of resetting a shared counter
+    limit = int(settings.SYNC_PROVIDER_CONCURRENCY.get(source_type, settings.SYNC_DEFAULT_PROVIDER_CONCURRENCY))
+    for slot in range(limit):
+        slot_key = f'sync-provider-slot:{source_type}:{slot}'
+        if cache.add(slot_key, True, timeout=settings.SYNC_LOCK_TIMEOUT):
+            return slot_key
+    return None
+
+
+def release_provider_slot(slot_key):
+    cache.delete(slot_key)
+
+
+@shared_task(bind=True, name=SYNC_SOURCE_TASK, max_retries=None)
+def sync_source(self, source_id):
+    source = Source.objects.select_related('project').get(pk=source_id)
+    lock_key = f'sync-source-lock:{source_id}'
+    if not cache.add(lock_key, True, timeout=settings.SYNC_LOCK_TIMEOUT):
+        print(f'Sync already running for {source}')
+        return None
+    try:
+        slot_key = acquire_provider_slot(source.source_type)
+        if slot_key is None:
+            raise self.retry(countdown=30)
+        try:
+            run = source.sync()
+        finally:
+            release_provider_slot(slot_key)
+    finally:
+        cache.delete(lock_key)
+    return {'source': source_id, 'event_count': run.event_count, 'duration': run.duration.total_seconds()}
+
+
+@shared_task(name='project.tasks.sync_all_sources')
+def sync_all_sources():
+    task_ids = []
+    for source_id, source_type in Source.objects.filter(enabled=True).values_list('id', 'source_type'):
+        route = settings.CELERY_TASK_ROUTES.get(f'{SYNC_SOURCE_TASK}.{source_type}', {})
+        task_ids.append(sync_source.apply_async(args=[source_id], **route).id)
+    return task_ids
@@ -1,9 +1,46 @@
-from django.test import TestCase
+import errno
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from celery.exceptions import Retry
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from datetime import timedelta, date
+from datetime import timedelta, date, datetime, timezone as dt_timezone
+from pathlib import Path
+from unittest import mock, skipUnless
 from dateutil.relativedelta import relativedelta
 from django.contrib.auth.models import User
-from project.models import Client, Project, TimeEntry
+from project import instrumentation
+from project.calendar import AzureCalendarExport
+from project.harvest import Harvest
+from project.importers import AzureImporter, BaseImporter, GitHubImporter, OutlookImporter
+from project.models import (
+    Client, Event, EventBlock, HarvestWatermark, PendingEventWindow, Project, ProjectDaySummary, ProjectMonthRollup,
+    Source, SourceRule, SourceRuleMatcher, SourceSyncRun, TimeEntry
+)
+from project.tasks import acquire_provider_slot, release_provider_slot, sync_all_sources, sync_source
+from project.tokens import get_graph_token, msal_applications
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+CALENDAR_CONFIG = {**settings.SYSTEM_CONFIG, 'calendar': {
+    'CLIENT_ID': 'client', 'CLIENT_SECRET': 'secret', 'TENANT_ID': 'tenant', 'USER_ID': 'user', 'CALENDAR_ID': 'calendar'
+}}
 
 
 class ProjectCalculationsTestCase(TestCase):
@@ -114,6 +151,25 @@ class ProjectCalculationsTestCase(TestCase):
         # Carryover = 30 - 40 = -10 hours (10 hours remaining)
         self.assertEqual(carryover, timedelta(hours=-10))
     
+    def test_months_since_start_matches_calendar_months(self):
+        self.assertEqual(self.project.months_since_start(date(2023, 12, 1)), 0)
+        self.assertEqual(self.project.months_since_start(date(2024, 1, 1)), 0)
+        self.assertEqual(self.project.months_since_start(date(2024, 1, 20)), 1)
+        self.assertEqual(self.project.months_since_start(date(2025, 3, 1)), 14)
+
+    def test_carryover_by_month_matches_carried_over_duration(self):
+        for month, hours, billable in [(1, 20, True), (2, 50, True), (2, 10, False), (4, 30, True), (12, 5, True)]:
+            TimeEntry.objects.create(
+                project=self.project, date=date(2024, month, 10), hours=timedelta(hours=hours),
+                harvest_id=f'harvest_{month}_{hours}', billable=billable)
+
+        with self.assertNumQueries(1):
+            carryover = self.project.carryover_by_month(date(2025, 2, 1))
+
+        self.assertEqual(list(carryover), [date(2024, 1, 1) + relativedelta(months=m) for m in range(14)])
+        for month_start, duration in carryover.items():
+            self.assertEqual(duration, self.project.carried_over_duration(month_start))
+
     def test_carried_over_duration_project_starts_mid_month(self):
         # Project starts Jan 15, checking March 1
         march_start = date(2024, 3, 1)
@@ -322,4 +378,1187 @@ class ProjectCalculationsTestCase(TestCase):
         
         # Remaining: 32 budget - (-3.2) - 34.25 = 32 + 3.2 - 34.25 = 0.95
         remaining = project.monthly_duration - carryover - timedelta(hours=34.25)
-        self.assertAlmostEqual(remaining.total_seconds() / 3600, 0.95, places=2)
\ No newline at end of file
+        self.assertAlmostEqual(remaining.total_seconds() / 3600, 0.95, places=2)
+
+
+class StubServer:
+    """Serve canned JSON responses from a local HTTP server for API client tests."""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+        stub = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def respond(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                request = (self.command, url.path, parse_qs(url.query), body, self.headers)
+                stub.requests.append(request)
+                status, headers, payload = stub.handler(*request)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                data = json.dumps(payload).encode() if payload is not None else b''
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = respond
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class HarvestTimeEntrySyncTestCase(TestCase):
+    def setUp(self):
+        self.client = Client.objects.create(name='Test Client', harvest_id='1')
+        self.project = Project.objects.create(name='Test Project', client=self.client, harvest_id='100')
+        self.harvest = Harvest()
+
+    def entry(self, harvest_id, spent_date, hours, billable=True, updated_at='2024-03-01T00:00:00Z'):
+        return {
+            'id': harvest_id,
+            'project': {'id': 100},
+            'spent_date': spent_date,
+            'hours': hours,
+            'notes': '- Did work',
+            'billable': billable,
+            'updated_at': updated_at
+        }
+
+    def test_save_time_entries_inserts_updates_and_deletes(self):
+        TimeEntry.objects.create(
+            project=self.project, date=date(2024, 3, 1), hours=timedelta(hours=1), harvest_id='1')
+        TimeEntry.objects.create(
+            project=self.project, date=date(2024, 3, 2), hours=timedelta(hours=1), harvest_id='2')
+
+        counts = self.harvest.save_time_entries(
+            [self.entry(1, '2024-03-01', 3), self.entry(3, '2024-03-03', 2, billable=False)],
+            date(2024, 3, 1), date(2024, 3, 31)
+        )
+
+        self.assertEqual(counts, {'fetched': 2, 'skipped': 0, 'inserted': 1, 'updated': 1, 'deleted': 1})
+        self.assertEqual(TimeEntry.objects.get(harvest_id='1').hours, timedelta(hours=3))
+        self.assertFalse(TimeEntry.objects.get(harvest_id='3').billable)
+        self.assertFalse(TimeEntry.objects.filter(harvest_id='2').exists())
+
+    def test_save_time_entries_keeps_last_of_repeated_records(self):
+        counts = self.harvest.save_time_entries(
+            [self.entry(1, '2024-03-01', 1), self.entry(1, '2024-03-01', 2)], date(2024, 3, 1), date(2024, 3, 31))
+
+        self.assertEqual((counts['inserted'], counts['updated']), (1, 0))
+        self.assertEqual(TimeEntry.objects.get(harvest_id='1').hours, timedelta(hours=2))
+
+    def test_save_time_entries_query_count_is_constant(self):
+        entries = [self.entry(i, '2024-03-01', 1) for i in range(50)]
+        with self.assertNumQueries(13):
+            self.harvest.save_time_entries(entries, date(2024, 3, 1), date(2024, 3, 31))
+        self.assertEqual(TimeEntry.objects.count(), 50)
+
+    def test_get_all_fetches_every_page_and_backs_off(self):
+        rate_limited = []
+
+        def handler(method, path, query, body, headers):
+            page = int(query['page'][0])
+            if page == 2 and not rate_limited:
+                rate_limited.append(page)
+                return 429, {'Retry-After': '0'}, {}
+            entries = [self.entry(page * 10 + i, '2024-03-01', 1) for i in range(2)]
+            return 200, {}, {'time_entries': entries, 'total_pages': 3, 'page': page}
+
+        with StubServer(handler) as server:
+            self.harvest.base_url = server.url
+            self.harvest.requester.headers = {}
+            records = self.harvest.get_all('time_entries', {'from': '2024-03-01'})
+
+        self.assertEqual(sorted(record['id'] for record in records), [10, 11, 20, 21, 30, 31])
+        self.assertEqual(rate_limited, [2])
+        self.assertEqual(len(server.requests), 4)
+
+    def test_get_all_drops_records_repeated_across_pages(self):
+        # Entry 2 was edited between reading page 1 and page 2 and moved onto page 2
+        pages = {
+            1: [self.entry(1, '2024-03-01', 1), self.entry(2, '2024-03-01', 1)],
+            2: [self.entry(2, '2024-03-01', 4), self.entry(3, '2024-03-01', 1)],
+        }
+
+        def handler(method, path, query, body, headers):
+            return 200, {}, {'time_entries': pages[int(query['page'][0])], 'total_pages': 2}
+
+        with StubServer(handler) as server:
+            self.harvest.base_url = server.url
+            self.harvest.requester.headers = {}
+            records = self.harvest.get_all('time_entries')
+
+        self.assertEqual([(record['id'], record['hours']) for record in records], [(1, 1), (2, 4), (3, 1)])
+
+    def test_incremental_sync_uses_watermark_and_keeps_unfetched_entries(self):
+        TimeEntry.objects.create(
+            project=self.project, date=date(2024, 3, 2), hours=timedelta(hours=1), harvest_id='2')
+        HarvestWatermark.objects.create(
+            resource='time_entries', updated_since=datetime(2024, 3, 1, tzinfo=dt_timezone.utc))
+        # Edited while the fetch was running, after entries edited earlier were already read
+        entries = [self.entry(1, '2024-03-01', 3, updated_at='2024-03-05T12:30:00Z')]
+        fetch_started_at = datetime(2024, 3, 5, 12, tzinfo=dt_timezone.utc)
+
+        with mock.patch.object(Harvest, 'get_all', return_value=entries) as get_all, \
+                mock.patch.object(timezone, 'now', return_value=fetch_started_at):
+            counts = self.harvest.get_time_entries(date(2024, 3, 1), date(2024, 3, 31), full=False)
+
+        self.assertEqual(get_all.call_args.args[1]['updated_since'], '2024-03-01T00:00:00+00:00')
+        self.assertEqual(counts['fetched'], 1)
+        self.assertEqual(counts['skipped'], 1)
+        self.assertEqual(counts['deleted'], 0)
+        self.assertTrue(TimeEntry.objects.filter(harvest_id='2').exists())
+        self.assertEqual(
+            HarvestWatermark.objects.get(resource='time_entries').updated_since,
+            fetch_started_at - Harvest.watermark_margin)
+
+    def test_full_sync_ignores_watermark_and_records_reconcile(self):
+        HarvestWatermark.objects.create(
+            resource='time_entries', updated_since=datetime(2024, 3, 1, tzinfo=dt_timezone.utc))
+        self.assertTrue(self.harvest.needs_full_sync())
+
+        with mock.patch.object(Harvest, 'get_all', return_value=[]) as get_all:
+            self.harvest.get_time_entries(date(2024, 3, 1), date(2024, 3, 31), full=True)
+
+        self.assertNotIn('updated_since', get_all.call_args.args[1])
+        self.assertFalse(self.harvest.needs_full_sync())
+
+    def test_scoped_sync_keeps_global_watermark(self):
+        HarvestWatermark.objects.create(
+            resource='time_entries', updated_since=datetime(2024, 3, 1, tzinfo=dt_timezone.utc))
+        entries = [self.entry(1, '2024-03-01', 3)]
+        fetch_started_at = datetime(2024, 3, 5, 12, tzinfo=dt_timezone.utc)
+
+        with mock.patch.object(Harvest, 'get_all', return_value=entries), \
+                mock.patch.object(timezone, 'now', return_value=fetch_started_at):
+            self.harvest.get_time_entries(date(2024, 3, 1), date(2024, 3, 31), full=True, harvest_project_id=100)
+        with mock.patch.object(Harvest, 'get_all', return_value=[]) as get_all:
+            self.harvest.get_time_entries(date(2024, 3, 1), date(2024, 3, 31), full=False)
+
+        self.assertEqual(get_all.call_args.args[1]['updated_since'], '2024-03-01T00:00:00+00:00')
+        self.assertTrue(self.harvest.needs_full_sync())
+        self.assertEqual(
+            HarvestWatermark.objects.get(resource='time_entries:100').updated_since,
+            fetch_started_at - Harvest.watermark_margin)
+
+    def test_reconcile_is_scoped_to_synced_projects(self):
+        local_project = Project.objects.create(name='Local Project', client=self.client)
+        other_project = Project.objects.create(name='Other Project', client=self.client, harvest_id='200')
+        TimeEntry.objects.create(
+            project=local_project, date=date(2024, 3, 2), hours=timedelta(hours=1), harvest_id='local')
+        TimeEntry.objects.create(
+            project=other_project, date=date(2024, 3, 2), hours=timedelta(hours=1), harvest_id='other')
+        TimeEntry.objects.create(
+            project=self.project, date=date(2024, 3, 2), hours=timedelta(hours=1), harvest_id='stale')
+
+        counts = self.harvest.save_time_entries(
+            [self.entry(1, '2024-03-01', 1)], date(2024, 3, 1), date(2024, 3, 31), harvest_project_id=100)
+
+        self.assertEqual(counts['deleted'], 1)
+        self.assertEqual(
+            set(TimeEntry.objects.values_list('harvest_id', flat=True)), {'1', 'local', 'other'})
+
+
+@override_settings(TIMESHEET={'minimum_task_minutes': 15, 'time_on_task_minutes': 30})
+class EventBlockGroupingTestCase(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='Test Project')
+        self.source = Source.objects.create(source_type='github', project=self.project)
+
+    def add_events(self, *times):
+        # As the importers flush them
+        Event.objects.bulk_create([
+            Event(source=self.source, event_text=f'Event {time}', event_hash=Event.hash_text(f'Event {time}'),
+                  timestamp=time) for time in times
+        ])
+        Event.queue_grouping(self.project.pk, times)
+
+    def block_ranges(self):
+        return list(self.project.eventblock_set.order_by('start_timestamp').values_list(
+            'start_timestamp', 'end_timestamp'))
+
+    def test_group_event_blocks_splits_on_time_on_task(self):
+        start = datetime(2024, 3, 1, 9, tzinfo=dt_timezone.utc)
+        self.add_events(start, start + timedelta(minutes=10), start + timedelta(minutes=50),
+                        start + timedelta(hours=2))
+
+        with self.assertNumQueries(7):
+            self.project.group_event_blocks()
+
+        self.assertEqual(self.block_ranges(), [
+            (start, start + timedelta(minutes=10)),
+            (start + timedelta(minutes=50), start + timedelta(minutes=65)),
+            (start + timedelta(hours=2), start + timedelta(hours=2, minutes=15)),
+        ])
+
+    def test_days_with_events_uses_local_dates(self):
+        morning = datetime(2024, 3, 1, 9, tzinfo=settings.AS_LOCAL_TIME_ZONE)
+        self.add_events(morning, morning + timedelta(hours=1), morning + timedelta(days=1))
+        self.assertEqual(self.project.days_with_events(), {date(2024, 3, 1), date(2024, 3, 2)})
+
+    def test_group_event_blocks_is_incremental(self):
+        start = datetime(2024, 3, 1, 9, tzinfo=dt_timezone.utc)
+        self.add_events(start, start + timedelta(hours=2))
+        self.project.group_event_blocks()
+        self.project.group_event_blocks()
+        self.assertEqual(self.project.eventblock_set.count(), 2)
+
+        # Extends the trailing block and starts a new one after it
+        self.add_events(start + timedelta(hours=2, minutes=20), start + timedelta(hours=5))
+        # Arrives late and bridges the first block with nothing else
+        self.add_events(start + timedelta(minutes=20))
+        self.project.group_event_blocks()
+
+        self.assertEqual(self.block_ranges(), [
+            (start, start + timedelta(minutes=20)),
+            (start + timedelta(hours=2), start + timedelta(hours=2, minutes=20)),
+            (start + timedelta(hours=5), start + timedelta(hours=5, minutes=15)),
+        ])
+
+    def test_group_event_blocks_untouched_blocks_survive(self):
+        start = datetime(2024, 3, 1, 9, tzinfo=dt_timezone.utc)
+        self.add_events(start, start + timedelta(days=1))
+        self.project.group_event_blocks()
+        first_block = self.project.eventblock_set.order_by('start_timestamp').first()
+
+        self.add_events(start + timedelta(days=1, minutes=10))
+        self.project.group_event_blocks()
+
+        self.assertTrue(EventBlock.objects.filter(pk=first_block.pk).exists())
+        self.assertEqual(self.project.eventblock_set.count(), 2)
+
+    def test_group_event_blocks_picks_up_late_commits(self):
+        start = datetime(2024, 3, 1, 9, tzinfo=dt_timezone.utc)
+        self.add_events(start)
+        self.project.group_event_blocks()
+
+        # Created before the last run but committed after it, as with a slow parallel source sync
+        late_event = Event(source=self.source, event_text='Late', timestamp=(start + timedelta(hours=2)).isoformat())
+        late_event.save()
+        Event.objects.filter(pk=late_event.pk).update(created_at=start)
+        self.project.group_event_blocks()
+
+        self.assertEqual(self.project.eventblock_set.count(), 2)
+        self.assertFalse(PendingEventWindow.objects.exists())
+
+    def test_regrouping_keeps_block_summary_and_calendar_event(self):
+        start = datetime(2024, 3, 1, 9, tzinfo=dt_timezone.utc)
+        self.add_events(start, start + timedelta(hours=2))
+        self.project.group_event_blocks()
+        first_block, second_block = self.project.eventblock_set.order_by('start_timestamp')
+        EventBlock.objects.filter(pk=first_block.pk).update(
+            summary='Reviewed', uploaded_to_calendar=True, graph_event_id='remote')
+
+        self.add_events(start + timedelta(minutes=10), start + timedelta(minutes=20))
+        self.project.group_event_blocks()
+        extended = EventBlock.objects.get(pk=first_block.pk)
+        self.assertEqual((extended.end_timestamp, extended.summary, extended.graph_event_id),
+                         (start + timedelta(minutes=20), 'Reviewed', 'remote'))
+
+        # Bridging both blocks keeps the first and drops the one it absorbed
+        self.add_events(*(start + timedelta(minutes=minutes) for minutes in range(30, 120, 10)))
+        self.project.group_event_blocks(full=True)
+        self.assertEqual(list(self.project.eventblock_set.values_list('pk', 'graph_event_id')),
+                         [(first_block.pk, 'remote')])
+        self.assertFalse(EventBlock.objects.filter(pk=second_block.pk).exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SourceRuleMatcherTestCase(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='Test Project')
+        self.source = Source.objects.create(source_type='github', project=self.project)
+
+    def test_matcher_agrees_with_check_rule(self):
+        rules = [
+            SourceRule(rule_type=SourceRule.EXACT, rule='deploy'),
+            SourceRule(rule_type=SourceRule.STARTS_WITH, rule='feat:'),
+            SourceRule(rule_type=SourceRule.END_WITH, rule='[logsheet]'),
+            SourceRule(rule_type=SourceRule.CONTAINS, rule='a+b'),
+            SourceRule(rule_type=SourceRule.REGEX, rule=r'JIRA-\d+'),
+        ]
+        matcher = SourceRuleMatcher((rule.rule_type, rule.rule) for rule in rules)
+        for event_text in ['deploy', 'deploy now', 'feat: add x', 'fix [logsheet]', 'use a+b here', 'aab',
+                           'JIRA-12 fix', 'fix JIRA-12', '']:
+            with self.subTest(event_text=event_text):
+                self.assertEqual(matcher.match(event_text), any(rule.check_rule(event_text) for rule in rules))
+
+    def test_matcher_is_cached_and_invalidated_on_rule_change(self):
+        rule = SourceRule.objects.create(source=self.source, rule_type=SourceRule.CONTAINS, rule='logsheet')
+        self.assertTrue(self.source.rule_matcher().match('work on logsheet'))
+        with self.assertNumQueries(0):
+            self.source.rule_matcher()
+
+        rule.rule = 'harvest'
+        rule.save()
+        self.assertFalse(self.source.rule_matcher().match('work on logsheet'))
+
+        rule.delete()
+        self.assertFalse(self.source.rule_matcher().match('work on harvest'))
+
+    def test_cached_matcher_is_versioned_and_expires(self):
+        SourceRule.objects.create(source=self.source, rule_type=SourceRule.CONTAINS, rule='logsheet')
+        with mock.patch.object(cache, 'set') as cache_set:
+            self.source.rule_matcher()
+        self.assertEqual(cache_set.call_args.kwargs['timeout'], Source.rule_matcher_timeout)
+        self.source.rule_matcher()
+
+        # Bulk changes skip the eviction signal, and a changed matcher class doesn't read old entries
+        SourceRule.objects.filter(source=self.source).update(rule='harvest')
+        with mock.patch.object(SourceRuleMatcher, 'version', SourceRuleMatcher.version + 1):
+            self.assertTrue(self.source.rule_matcher().match('work on harvest'))
+
+    def test_save_event_does_not_query_rules_per_event(self):
+        SourceRule.objects.create(source=self.source, rule_type=SourceRule.STARTS_WITH, rule='feat')
+        importer = GitHubImporter(self.source)
+        with self.assertNumQueries(1):
+            for index in range(20):
+                importer.save_event(f'feat {index}' if index % 2 else f'chore {index}', '2024-03-01T00:00:00Z')
+        self.assertEqual(len(importer.batch), 10)
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    SYNC_PROVIDER_CONCURRENCY={'outlook': 1},
+    CELERY_TASK_ROUTES={'project.tasks.sync_source.outlook': {'queue': 'slow'}}
+)
+class SyncOrchestratorTestCase(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='Test Project')
+        self.github = Source.objects.create(source_type='github', project=self.project)
+        self.outlook = Source.objects.create(source_type='outlook', project=self.project)
+        Source.objects.create(source_type='github', project=self.project, enabled=False)
+
+    def test_sync_all_sources_fans_out_enabled_sources_with_routes(self):
+        with mock.patch.object(sync_source, 'apply_async') as apply_async:
+            sync_all_sources()
+        calls = {call.kwargs['args'][0]: call.kwargs.get('queue') for call in apply_async.call_args_list}
+        self.assertEqual(calls, {self.github.pk: None, self.outlook.pk: 'slow'})
+
+    def test_sync_source_records_run(self):
+        with mock.patch.object(GitHubImporter, 'fetch_events'):
+            result = sync_source.apply(args=[self.github.pk]).get()
+        run = SourceSyncRun.objects.get(source=self.github)
+        self.assertEqual(result['event_count'], 0)
+        self.assertIsNotNone(run.duration)
+
+    def test_sync_source_skips_when_already_running(self):
+        cache.add(f'sync-source-lock:{self.github.pk}', True)
+        with mock.patch.object(GitHubImporter, 'fetch_events') as fetch_events:
+            self.assertIsNone(sync_source.apply(args=[self.github.pk]).get())
+        fetch_events.assert_not_called()
+        self.assertFalse(SourceSyncRun.objects.exists())
+
+    def test_sync_source_retries_when_provider_is_saturated(self):
+        cache.set('sync-provider-slot:outlook:0', True)
+        with mock.patch.object(sync_source, 'retry', side_effect=Retry):
+            with self.assertRaises(Retry):
+                sync_source(self.outlook.pk)
+        self.assertIsNone(cache.get(f'sync-source-lock:{self.outlook.pk}'))
+        self.assertTrue(cache.get('sync-provider-slot:outlook:0'))
+
+    @override_settings(SYNC_PROVIDER_CONCURRENCY={'github': 2})
+    def test_provider_slots_expire_per_holder(self):
+        first_slot = acquire_provider_slot('github')
+        second_slot = acquire_provider_slot('github')
+        self.assertIsNone(acquire_provider_slot('github'))
+
+        # A holder whose slot expired mid-sync releases without error and leaves the other holder's slot alone
+        cache.delete(first_slot)
+        release_provider_slot(first_slot)
+        self.assertTrue(cache.get(second_slot))
+        self.assertEqual(acquire_provider_slot('github'), first_slot)
+        self.assertIsNone(acquire_provider_slot('github'))
+
+
+class PagedImporter(BaseImporter):
+    chunk_size = 2
+
+    def __init__(self, source, pages, fail_on_page=None):
+        super().__init__(source)
+        self.pages = pages
+        self.fail_on_page = fail_on_page
+        self.fetched_pages = []
+
+    def fetch_events(self):
+        for page_number in range(self.checkpoint or 0, len(self.pages)):
+            if page_number == self.fail_on_page:
+                raise ConnectionError('Lost connection')
+            self.fetched_pages.append(page_number)
+            for event_text in self.pages[page_number]:
+                self.save_event(event_text, datetime(2024, 3, 1, tzinfo=dt_timezone.utc))
+            self.set_checkpoint(page_number + 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StreamingImporterTestCase(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='Test Project')
+        self.source = Source.objects.create(source_type='github', project=self.project)
+        SourceRule.objects.create(source=self.source, rule_type=SourceRule.STARTS_WITH, rule='event')
+        self.pages = [['event 1', 'event 2', 'event 3'], ['event 4', 'event 5'], ['event 6']]
+
+    def test_sync_flushes_in_chunks(self):
+        importer = PagedImporter(self.source, self.pages)
+        self.assertEqual(importer.sync(), 6)
+        self.assertEqual(self.source.event_set.count(), 6)
+        self.source.refresh_from_db()
+        self.assertIsNone(self.source.checkpoint)
+        self.assertIsNotNone(self.source.last_sync)
+
+    def test_crashed_sync_resumes_from_checkpoint(self):
+        with self.assertRaises(ConnectionError):
+            PagedImporter(self.source, self.pages, fail_on_page=2).sync()
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.checkpoint, 1)
+        self.assertEqual(self.source.event_set.count(), 4)
+
+        importer = PagedImporter(self.source, self.pages)
+        importer.sync()
+        self.assertEqual(importer.fetched_pages, [1, 2])
+        self.assertEqual(self.source.event_set.count(), 6)
+
+    def test_events_are_deduplicated_by_content_hash(self):
+        # Far beyond the btree row size limit that a unique index over the raw text would hit
+        long_text = 'event ' + 'x' * 20000
+        self.assertEqual(PagedImporter(self.source, [[long_text, 'event 1'], [long_text]]).sync(), 3)
+        self.assertEqual(self.source.event_set.count(), 2)
+
+        event = self.source.event_set.get(event_text=long_text)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT encode(sha256(convert_to(%s, 'UTF8')), 'hex')", [long_text])
+            self.assertEqual(event.event_hash, cursor.fetchone()[0])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AzureImporterTestCase(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='Test Project')
+        self.source = Source.objects.create(source_type='azure', project=self.project)
+        SourceRule.objects.create(source=self.source, rule_type=SourceRule.STARTS_WITH, rule='Time')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        patcher = mock.patch.object(AzureImporter, 'directory', self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.write('a.csv', ['2024-03-01T09:00:00Z', '2024-03-01T10:00:00Z'])
+        self.write('b.csv', ['2024-03-02T09:00:00Z'])
+
+    def write(self, name, times):
+        (self.directory / name).write_text('Time,Operation\n' + ''.join(f'{time},Deploy\n' for time in times))
+
+    def sync(self):
+        return AzureImporter(Source.objects.get(pk=self.source.pk)).sync()
+
+    def test_unchanged_files_are_skipped(self):
+        self.assertEqual(self.sync(), 3)
+        self.assertEqual(sorted(self.source.importedfile_set.values_list('path', flat=True)), ['a.csv', 'b.csv'])
+        self.assertEqual(self.project.pendingeventwindow_set.count(), 3)
+
+        with mock.patch('project.importers.parse_azure_csv') as parse:
+            self.assertEqual(self.sync(), 0)
+        parse.assert_not_called()
+
+        self.write('b.csv', ['2024-03-02T09:00:00Z', '2024-03-02T11:00:00Z'])
+        os.utime(self.directory / 'a.csv', (0, 0))
+        self.assertEqual(self.sync(), 2)
+        self.assertEqual(self.source.event_set.count(), 4)
+        self.assertEqual(self.source.importedfile_set.get(path='a.csv').modified_at,
+                         datetime.fromtimestamp(0, tz=dt_timezone.utc))
+
+    def test_files_are_parsed_a_few_at_a_time(self):
+        for index in range(6):
+            self.write(f'c{index}.csv', [f'2024-03-{index + 3:02d}T09:00:00Z'])
+        submitted_before_save = []
+        submit = ProcessPoolExecutor.submit
+        save_parsed_file = AzureImporter.save_parsed_file
+
+        def record_save(importer, *args):
+            submitted_before_save.append(submit_mock.call_count)
+            save_parsed_file(importer, *args)
+
+        with mock.patch.object(AzureImporter, 'max_workers', 2), \
+                mock.patch.object(ProcessPoolExecutor, 'submit', autospec=True, side_effect=submit) as submit_mock, \
+                mock.patch.object(AzureImporter, 'save_parsed_file', record_save):
+            self.assertEqual(self.sync(), 9)
+        self.assertEqual(submitted_before_save, [3, 4, 5, 6, 7, 8, 8, 8])
+
+    def test_daemonic_workers_parse_in_threads(self):
+        daemon_error = AssertionError('daemonic processes are not allowed to have children')
+        with mock.patch('project.importers.current_process', return_value=mock.Mock(daemon=True)), \
+                mock.patch('project.importers.ProcessPoolExecutor', side_effect=daemon_error):
+            self.assertEqual(self.sync(), 3)
+        self.assertEqual(self.source.importedfile_set.count(), 2)
+
+    def test_imported_files_can_be_archived(self):
+        archive = self.directory / 'archive'
+        self.source.auth_dict = {'archive_dir': str(archive)}
+        self.source.save()
+        cross_device = OSError(errno.EXDEV, 'Invalid cross-device link')
+        with mock.patch('os.rename', side_effect=cross_device):
+            self.sync()
+        self.assertEqual(sorted(path.name for path in archive.iterdir()), ['a.csv', 'b.csv'])
+        self.assertEqual(list(self.directory.glob('*.csv')), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GitHubImporterTestCase(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='Test Project')
+        cache.clear()
+
+    def commit(self, message):
+        return {'commit': {'message': message, 'author': {'date': '2024-03-01T09:00:00Z'}}}
+
+    def handler(self, method, path, query, body, headers):
+        page = int(query.get('page', ['1'])[0])
+        etag = f'"{page}-{query.get("since")}"'
+        if headers.get('If-None-Match') == etag:
+            return 304, {'ETag': etag}, None
+        response_headers = {'ETag': etag}
+        if page == 1:
+            response_headers['Link'] = f'<{self.server.url}/repos/o/r/commits?per_page=100&page=2>; rel="next"'
+        return 200, response_headers, [self.commit(f'feat: page {page} commit {i}') for i in range(2)]
+
+    def test_incremental_sync_sends_since_and_stops_on_not_modified(self):
+        with StubServer(self.handler) as self.server:
+            source = Source.objects.create(
+                source_type='github', project=self.project, base_url=f'{self.server.url}/repos/o/r/commits')
+            SourceRule.objects.create(source=source, rule_type=SourceRule.STARTS_WITH, rule='feat')
+
+            self.assertEqual(GitHubImporter(source).sync(), 4)
+            self.assertEqual(self.server.requests[0][2]['per_page'], ['100'])
+            self.assertNotIn('since', self.server.requests[0][2])
+
+            GitHubImporter(source).sync()
+            self.assertEqual(self.server.requests[2][2]['since'], [f'{source.last_sync.date().isoformat()}T00:00:00Z'])
+
+            self.assertEqual(GitHubImporter(source).sync(), 0)
+
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertEqual(source.event_set.count(), 4)
+
+
+class GraphStandIn:
+    """Minimal Microsoft Graph mail delta endpoint backed by an in-memory mailbox."""
+
+    def __init__(self):
+        self.messages = []
+        self.expired_tokens = set()
+        self.server = StubServer(self.handle)
+
+    def message(self, subject):
+        return {
+            'subject': subject,
+            'receivedDateTime': '2024-03-01T09:00:00Z',
+            'bodyPreview': 'Body',
+            'from': {'emailAddress': {'address': 'client@example.com'}},
+            'toRecipients': [{'emailAddress': {'address': 'me@example.com'}}],
+            'ccRecipients': []
+        }
+
+    def handle(self, method, path, query, body, headers):
+        page_size = int(headers['Prefer'].split('=')[1])
+        start = int(query.get('skip', ['0'])[0])
+        if 'deltatoken' in query:
+            if query['deltatoken'][0] in self.expired_tokens:
+                return 410, {}, {'error': {'code': 'syncStateNotFound', 'message': 'Sync state is gone'}}
+            start = int(query['deltatoken'][0])
+        page = self.messages[start:start + page_size]
+        payload = {'value': page}
+        if start + page_size < len(self.messages):
+            payload['@odata.nextLink'] = f'{self.server.url}{path}?skip={start + page_size}'
+        else:
+            payload['@odata.deltaLink'] = f'{self.server.url}{path}?deltatoken={len(self.messages)}'
+        return 200, {}, payload
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class OutlookImporterTestCase(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='Test Project')
+        self.source = Source.objects.create(source_type='outlook', project=self.project, auth_dict={
+            'email': 'me@example.com', 'folders': ['inbox'], 'tenant_id': 't', 'client_id': 'c', 'client_secret': 's'
+        })
+        SourceRule.objects.create(source=self.source, rule_type=SourceRule.STARTS_WITH, rule='Subject')
+        self.graph = GraphStandIn()
+        self.graph.messages = [self.graph.message(f'Message {i}') for i in range(3)]
+
+    def importer(self):
+        with mock.patch.object(OutlookImporter, '_get_access_token', return_value='token'):
+            importer = OutlookImporter(self.source)
+        importer.graph_url = self.graph.server.url
+        importer.page_size = 2
+        return importer
+
+    def test_delta_sync_only_fetches_new_messages(self):
+        with self.graph.server:
+            self.assertEqual(self.importer().sync(), 3)
+            self.source.refresh_from_db()
+            self.assertIn('deltatoken=3', self.source.delta_links['inbox'])
+
+            self.graph.messages.append(self.graph.message('Message 3'))
+            self.assertEqual(self.importer().sync(), 1)
+
+        paths = [(request[1], request[2]) for request in self.graph.server.requests]
+        self.assertEqual(paths[0], ('/users/me@example.com/mailFolders/inbox/messages/delta', {
+            '$select': ['subject,receivedDateTime,bodyPreview,from,toRecipients,ccRecipients']}))
+        self.assertEqual(paths[2][1], {'deltatoken': ['3']})
+        self.assertEqual(len(paths), 3)
+        self.assertEqual(self.source.event_set.count(), 4)
+
+    def test_expired_delta_link_restarts_delta_sync(self):
+        with self.graph.server, mock.patch('builtins.print'):
+            self.importer().sync()
+            self.graph.expired_tokens.add('3')
+            self.graph.messages.append(self.graph.message('Message 3'))
+            self.source.refresh_from_db()
+            self.importer().sync()
+
+        self.source.refresh_from_db()
+        self.assertIn('deltatoken=4', self.source.delta_links['inbox'])
+        self.assertEqual(self.source.event_set.count(), 4)
+        paths = [request[1] for request in self.graph.server.requests]
+        self.assertEqual(paths[-3:], ['/users/me@example.com/mailFolders/inbox/messages/delta'] * 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GraphTokenTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        msal_applications.clear()
+
+    def test_token_is_shared_until_shortly_before_expiry(self):
+        with mock.patch('msal.ConfidentialClientApplication') as application:
+            application.return_value.acquire_token_for_client.return_value = {
+                'access_token': 'token', 'expires_in': 3599}
+            self.assertEqual(get_graph_token('tenant', 'client', 'secret'), 'token')
+            self.assertEqual(get_graph_token('tenant', 'client', 'secret'), 'token')
+            with mock.patch.object(cache, 'set') as cache_set:
+                cache.delete('graph-token:tenant:client')
+                get_graph_token('tenant', 'client', 'secret')
+
+        self.assertEqual(application.return_value.acquire_token_for_client.call_count, 2)
+        self.assertEqual(cache_set.call_args.kwargs['timeout'], 3299)
+
+    def test_application_is_rebuilt_after_secret_rotation(self):
+        with mock.patch('msal.ConfidentialClientApplication') as application:
+            application.return_value.acquire_token_for_client.return_value = {
+                'access_token': 'token', 'expires_in': 3599}
+            get_graph_token('tenant', 'client', 'old-secret')
+            cache.clear()
+            get_graph_token('tenant', 'client', 'old-secret')
+            cache.clear()
+            get_graph_token('tenant', 'client', 'new-secret')
+
+        self.assertEqual([call.kwargs['client_credential'] for call in application.call_args_list],
+                         ['old-secret', 'new-secret'])
+
+
+@override_settings(SYSTEM_CONFIG=CALENDAR_CONFIG, TIMESHEET={'minimum_task_minutes': 15, 'time_on_task_minutes': 30})
+class CalendarExportTestCase(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='Test Project')
+        start = datetime(2024, 3, 1, 9, tzinfo=dt_timezone.utc)
+        EventBlock.objects.bulk_create([
+            EventBlock(project=self.project, start_timestamp=start + timedelta(hours=i),
+                       end_timestamp=start + timedelta(hours=i, minutes=30), summary=f'- Block {i}')
+            for i in range(45)
+        ])
+        self.throttled = set()
+
+    def handler(self, method, path, query, body, headers):
+        responses = []
+        for request in body['requests']:
+            if request['id'] not in self.throttled and len(self.throttled) < 3:
+                self.throttled.add(request['id'])
+                responses.append({'id': request['id'], 'status': 429, 'headers': {'Retry-After': '0'}})
+            else:
+                responses.append({'id': request['id'], 'status': 201, 'body': {'id': f'graph-{request["id"]}'}})
+        return 200, {}, {'responses': responses}
+
+    def test_add_all_to_calendar_uses_batches(self):
+        with StubServer(self.handler) as server, \
+                mock.patch.object(AzureCalendarExport, 'token', 'token'), \
+                mock.patch.object(AzureCalendarExport, 'ENDPOINT', server.url):
+            self.project.add_all_to_calendar()
+
+        batch_sizes = [len(request[3]['requests']) for request in server.requests]
+        self.assertEqual(sum(batch_sizes), 45 + len(self.throttled))
+        self.assertEqual(max(batch_sizes), 20)
+        self.assertTrue(all(request[1] == '/$batch' for request in server.requests))
+        self.assertFalse(self.project.eventblock_set.filter(uploaded_to_calendar=False).exists())
+
+    def test_failed_batches_do_not_lose_created_events(self):
+        first_block = EventBlock.objects.order_by('-start_timestamp').first()
+        attempts = []
+
+        def handler(method, path, query, body, headers):
+            ids = [request['id'] for request in body['requests']]
+            attempts.append(ids)
+            # Every batch is throttled once as a whole, and the one holding the latest block keeps failing
+            if attempts.count(ids) == 1:
+                return 429, {'Retry-After': '0'}, {}
+            if str(first_block.pk) in ids:
+                return 503, {'Retry-After': '0'}, {}
+            return 200, {}, {'responses': [
+                {'id': request_id, 'status': 201, 'body': {'id': f'graph-{request_id}'}} for request_id in ids]}
+
+        with StubServer(handler) as server, \
+                mock.patch.object(AzureCalendarExport, 'token', 'token'), \
+                mock.patch.object(AzureCalendarExport, 'ENDPOINT', server.url), \
+                mock.patch.object(AzureCalendarExport, 'max_retries', 2), \
+                mock.patch('builtins.print'):
+            self.project.add_all_to_calendar()
+
+        self.assertEqual(self.project.eventblock_set.filter(uploaded_to_calendar=True).count(), 25)
+        self.assertFalse(EventBlock.objects.get(pk=first_block.pk).uploaded_to_calendar)
+
+    def calendar_handler(self, method, path, query, body, headers):
+        if method == 'GET' and 'skip' not in query:
+            self.assertEqual(query['$select'], ['subject,start,end'])
+            return 200, {}, {'value': [self.remote_event('same', self.blocks[0])],
+                             '@odata.nextLink': f'{self.server.url}{path}?skip=1'}
+        if method == 'GET':
+            changed = self.remote_event('changed', self.blocks[1])
+            changed['subject'] = 'Old summary'
+            return 200, {}, {'value': [changed, {'id': 'orphan', 'subject': 'Old block'}]}
+        status = {'POST': 201, 'PATCH': 200, 'DELETE': 204}
+        return 200, {}, {'responses': [
+            {'id': request['id'], 'status': status[request['method']], 'body': {'id': 'new'}}
+            for request in body['requests']
+        ]}
+
+    def remote_event(self, event_id, event_block):
+        formatted = AzureCalendarExport.format_event_block(event_block)
+        return {'id': event_id, 'subject': formatted['subject'],
+                'start': {'dateTime': formatted['start']['dateTime'] + '.0000000'},
+                'end': {'dateTime': formatted['end']['dateTime'] + '.0000000'}}
+
+    def test_sync_calendar_only_sends_changes(self):
+        EventBlock.objects.exclude(pk__in=EventBlock.objects.order_by('pk')[:3]).delete()
+        self.blocks = list(EventBlock.objects.order_by('pk'))
+        self.blocks[0].graph_event_id = 'same'
+        self.blocks[1].graph_event_id = 'changed'
+        EventBlock.objects.bulk_update(self.blocks, ['graph_event_id'])
+
+        with StubServer(self.calendar_handler) as self.server, \
+                mock.patch.object(AzureCalendarExport, 'token', 'token'), \
+                mock.patch.object(AzureCalendarExport, 'ENDPOINT', self.server.url):
+            counts = EventBlock.sync_calendar()
+
+        self.assertEqual(counts, {'created': 1, 'updated': 1, 'deleted': 1})
+        batch = self.server.requests[-1][3]['requests']
+        self.assertEqual(sorted((request['method'], request['url'].rsplit('/', 1)[-1]) for request in batch), [
+            ('DELETE', 'orphan'), ('PATCH', 'changed'), ('POST', 'events')])
+        self.assertEqual(EventBlock.objects.get(pk=self.blocks[2].pk).graph_event_id, 'new')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProjectMonthRollupTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser('admin', 'admin@test.com', 'password')
+        self.client.force_login(self.user)
+        self.timesheet_client = Client.objects.create(name='Test Client', user=self.user)
+        self.project = Project.objects.create(
+            name='Test Project', client=self.timesheet_client, harvest_id='100',
+            project_start_date=date(2024, 1, 15), monthly_duration=timedelta(hours=40))
+        self.harvest = Harvest()
+
+    def entry(self, harvest_id, spent_date, hours, billable=True):
+        return {'id': harvest_id, 'project': {'id': 100}, 'spent_date': spent_date, 'hours': hours,
+                'notes': '- Work', 'billable': billable}
+
+    def rollups(self):
+        return list(self.project.projectmonthrollup_set.order_by('month').values_list(
+            'month', 'hours', 'billable_hours', 'cumulative_billable_hours'))
+
+    def test_harvest_sync_maintains_rollups(self):
+        self.harvest.save_time_entries([
+            self.entry(1, '2024-01-20', 30),
+            self.entry(2, '2024-01-25', 5, billable=False),
+            self.entry(3, '2024-03-10', 10),
+        ], date(2024, 1, 1), date(2024, 3, 31))
+        self.assertEqual(self.rollups(), [
+            (date(2024, 1, 1), timedelta(hours=35), timedelta(hours=30), timedelta(hours=30)),
+            (date(2024, 2, 1), timedelta(), timedelta(), timedelta(hours=30)),
+            (date(2024, 3, 1), timedelta(hours=10), timedelta(hours=10), timedelta(hours=40)),
+        ])
+        january = self.project.projectmonthrollup_set.get(month=date(2024, 1, 1)).updated_at
+
+        self.harvest.save_time_entries([
+            self.entry(1, '2024-01-20', 30),
+            self.entry(2, '2024-01-25', 5, billable=False),
+            self.entry(3, '2024-02-10', 10),
+        ], date(2024, 1, 1), date(2024, 3, 31))
+        self.assertEqual(self.rollups()[1:], [
+            (date(2024, 2, 1), timedelta(hours=10), timedelta(hours=10), timedelta(hours=40)),
+        ])
+        self.assertEqual(self.project.projectmonthrollup_set.get(month=date(2024, 1, 1)).updated_at, january)
+
+    def test_time_entry_changes_maintain_rollups(self):
+        time_entry = TimeEntry.objects.create(
+            project=self.project, date=date(2024, 2, 10), hours=timedelta(hours=5), harvest_id='1', billable=True)
+        self.assertEqual(self.rollups(), [
+            (date(2024, 2, 1), timedelta(hours=5), timedelta(hours=5), timedelta(hours=5)),
+        ])
+
+        time_entry = TimeEntry.objects.get(pk=time_entry.pk)
+        time_entry.date = date(2024, 3, 10)
+        time_entry.save()
+        self.assertEqual(self.rollups(), [
+            (date(2024, 2, 1), timedelta(), timedelta(), timedelta()),
+            (date(2024, 3, 1), timedelta(hours=5), timedelta(hours=5), timedelta(hours=5)),
+        ])
+
+        time_entry.delete()
+        self.assertEqual(self.rollups()[1:], [
+            (date(2024, 3, 1), timedelta(), timedelta(), timedelta()),
+        ])
+        TimeEntry.objects.create(project=self.project, date=date(2024, 2, 10), hours=timedelta(hours=1))
+        self.project.delete()
+        self.assertFalse(ProjectMonthRollup.objects.exists())
+
+    def test_timesheet_reads_carryover_from_rollups(self):
+        self.harvest.save_time_entries([
+            self.entry(month, f'2024-{month:02d}-10', 30 + month) for month in range(1, 7)
+        ], date(2024, 1, 1), date(2024, 6, 30))
+
+        response = self.client.get(f'/timesheet/{self.project.pk}/2024-06')
+        context = response.context
+        carryover = self.project.carried_over_duration(date(2024, 6, 1))
+        self.assertEqual(context['carried_over'], response.context['view'].format_duration(carryover))
+        self.assertEqual(context['project_months'][1:], [date(2024, month, 1) for month in range(6, 0, -1)])
+
+        with self.assertNumQueries(9):
+            self.client.get(f'/timesheet/{self.project.pk}/2024-03')
+
+    def test_timesheet_month_is_cached_until_its_entries_change(self):
+        self.harvest.save_time_entries([self.entry(1, '2024-02-10', 30), self.entry(2, '2024-03-10', 5)],
+                                       date(2024, 2, 1), date(2024, 3, 31))
+        url = f'/timesheet/{self.project.pk}/2024-02'
+        self.client.get(url)
+        with self.assertNumQueries(7):
+            response = self.client.get(url)
+        self.assertEqual(response.context['total_billable'], '30 hr')
+
+        # A change in a later month leaves the cached figures alone, an earlier one replaces them
+        self.harvest.save_time_entries([self.entry(2, '2024-03-10', 8)], date(2024, 3, 1), date(2024, 3, 31))
+        with self.assertNumQueries(7):
+            self.client.get(url)
+        self.harvest.save_time_entries([self.entry(1, '2024-02-10', 20)], date(2024, 2, 1), date(2024, 2, 29))
+        self.assertEqual(self.client.get(url).context['total_billable'], '20 hr')
+
+    def test_timesheet_answers_conditional_requests(self):
+        self.harvest.save_time_entries([self.entry(1, '2024-02-10', 30)], date(2024, 2, 1), date(2024, 2, 29))
+        url = f'/timesheet/{self.project.pk}/2024-02'
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT').status_code, 200)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.harvest.save_time_entries([self.entry(1, '2024-02-10', 20)], date(2024, 2, 1), date(2024, 2, 29))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+        # Names shown in the header and project picker are part of the validator too
+        etag = self.client.get(url)['ETag']
+        Project.objects.create(name='Sibling Project', client=self.timesheet_client)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.client.get(url)['ETag']
+        Client.objects.filter(pk=self.timesheet_client.pk).update(name='Renamed Client')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class TimesheetApiTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('client', 'client@test.com', 'password')
+        other_user = User.objects.create_user('other', 'other@test.com', 'password')
+        self.project = Project.objects.create(
+            name='Visible', client=Client.objects.create(name='Mine', user=self.user))
+        hidden = Project.objects.create(name='Hidden', client=Client.objects.create(name='Theirs', user=other_user))
+        for day in range(1, 6):
+            TimeEntry.objects.create(project=self.project, date=date(2024, 3, day), hours=timedelta(minutes=90),
+                                     notes=f'- Day {day}', harvest_id=f'visible_{day}', billable=day % 2 == 1)
+        TimeEntry.objects.create(project=hidden, date=date(2024, 3, 1), hours=timedelta(hours=1), harvest_id='hidden')
+        self.client.force_login(self.user)
+
+    def test_time_entries_are_filtered_and_cursor_paginated(self):
+        response = self.client.get('/api/time-entries/', {
+            'date_after': '2024-03-02', 'date_before': '2024-03-05', 'billable': 'false', 'page_size': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry['harvest_id'] for entry in response.json()['results']], ['visible_4'])
+
+        response = self.client.get(response.json()['next'])
+        self.assertEqual([entry['harvest_id'] for entry in response.json()['results']], ['visible_2'])
+        self.assertIsNone(response.json()['next'])
+
+        projects = self.client.get('/api/projects/').json()['results']
+        self.assertEqual([project['name'] for project in projects], ['Visible'])
+
+    def test_export_streams_csv_rows(self):
+        response = self.client.get('/api/time-entries/export/', {'billable': 'true'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0], 'date,project,hours,billable,notes,harvest_id')
+        self.assertEqual(lines[1:], [f'2024-03-0{day},Visible,1.5,True,- Day {day},visible_{day}' for day in (1, 3, 5)])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, INSTRUMENTATION_METRICS_TOKEN='scrape')
+class InstrumentationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        instrumentation.totals.clear()
+        self.user = User.objects.create_superuser('admin', 'admin@test.com', 'password')
+        self.project = Project.objects.create(
+            name='Test Project', client=Client.objects.create(name='Test Client', user=self.user))
+
+    def test_requests_record_queries_and_cache_use(self):
+        self.client.force_login(self.user)
+        with self.assertLogs('project.instrumentation') as log:
+            self.client.get(f'/timesheet/{self.project.pk}/2024-03')
+            self.client.get(f'/timesheet/{self.project.pk}/2024-03')
+
+        record = json.loads(log.records[-1].getMessage())
+        self.assertEqual(record['name'], 'GET timesheet/<int:pk>/<str:month>')
+        self.assertEqual((record['cache_hits'], record['cache_misses']), (1, 0))
+        totals = instrumentation.totals[('request', record['name'])]
+        self.assertEqual((totals['count'], totals['cache_misses']), (2, 1))
+        self.assertGreater(totals['db_queries'], 0)
+
+        self.client.logout()
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape')
+        self.assertIn('logsheet_count_total{kind="request",name="GET timesheet/<int:pk>/<str:month>"} 2',
+                      response.content.decode())
+
+    def test_tasks_record_external_calls(self):
+        source = Source.objects.create(source_type='github', project=self.project, base_url='http://127.0.0.1/')
+
+        def handler(method, path, query, body, headers):
+            return 200, {}, []
+
+        with StubServer(handler) as server, mock.patch('builtins.print'):
+            source.base_url = f'{server.url}/commits'
+            source.save()
+            sync_source.apply(args=[source.pk])
+
+        totals = instrumentation.totals[('task', 'project.tasks.sync_source')]
+        self.assertEqual((totals['count'], totals['errors'], totals['http_calls']), (1, 0, 1))
+
+    def test_worker_threads_record_to_the_caller(self):
+        def handler(method, path, query, body, headers):
+            return 200, {}, {'time_entries': [], 'total_pages': 5}
+
+        harvest = Harvest()
+        with StubServer(handler) as server, self.assertLogs('project.instrumentation'):
+            harvest.base_url = server.url
+            harvest.requester.headers = {}
+            with instrumentation.track('task', 'paged') as metrics:
+                harvest.get_all('time_entries')
+
+        self.assertEqual(metrics.http_calls, 5)
+        self.assertEqual(metrics.http_hosts, {'127.0.0.1': 5})
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_unsampled_work_is_not_recorded(self):
+        with instrumentation.track('task', 'skipped') as metrics:
+            instrumentation.record_cache(True)
+        self.assertIsNone(metrics)
+        self.assertEqual(instrumentation.totals, {})
+
+
+class QueryPlanTestCase(TestCase):
+    def setUp(self):
+        rng = random.Random(1)
+        self.projects = Project.objects.bulk_create([Project(name=f'Project {i}') for i in range(20)])
+        TimeEntry.objects.bulk_create([TimeEntry(
+            project=rng.choice(self.projects), date=date(2022, 1, 1) + timedelta(days=rng.randrange(1096)),
+            hours=timedelta(hours=1), harvest_id=str(i)) for i in range(20000)])
+        start = datetime(2022, 1, 1, tzinfo=dt_timezone.utc)
+        EventBlock.objects.bulk_create([EventBlock(
+            project=rng.choice(self.projects), start_timestamp=start + timedelta(hours=i),
+            end_timestamp=start + timedelta(hours=i, minutes=30)) for i in range(20000)])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE project_timeentry, project_eventblock')
+
+    def test_month_and_day_lookups_use_composite_indexes(self):
+        self.assertIn('timeentry_project_date', self.projects[0].events_in_month(3, 2023).explain())
+
+        summary = ProjectDaySummary(project=self.projects[0], date=date(2023, 3, 1))
+        self.assertIn('eventblock_project_start', summary.event_blocks().explain())
+
+        self.assertIn('timeentry_project_date', self.projects[0].timeentry_set.filter(
+            date__lt=date(2022, 3, 1), billable=True).values('hours').explain())
+
+
+def lean_startup_imports():
+    # Cumulative import time in microseconds of every module loaded by a lean-profile process, and of the
+    # outermost imports, whose cumulative times add up to the whole startup
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'logsheet.settings', 'LOGSHEET_PROFILE': 'lean'}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         'import django; django.setup(); import project.harvest, project.importers, project.calendar'],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True)
+    imports, roots = {}, {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and 'cumulative' not in line:
+            _, cumulative, module = line.split('|')
+            imports[module.strip()] = int(cumulative)
+            if not module.startswith('  '):
+                roots[module.strip()] = int(cumulative)
+    return imports, roots
+
+
+class LeanStartupTestCase(SimpleTestCase):
+    def test_lean_profile_skips_heavy_imports(self):
+        imports, _ = lean_startup_imports()
+        self.assertIn('project.harvest', imports)
+        for module in ['django.contrib.gis', 'django.contrib.admin', 'celery', 'msal', 'requests']:
+            self.assertNotIn(module, imports)
+
+
+BENCHMARK_SCALE = int(os.environ.get('BENCHMARK_SCALE') or 0)
+
+
+class GeneratedImporter(BaseImporter):
+    def __init__(self, source, count):
+        super().__init__(source)
+        self.count = count
+
+    def fetch_events(self):
+        start = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+        for i in range(self.count):
+            self.save_event(f'event {i}', start + timedelta(minutes=i))
+
+
+@skipUnless(BENCHMARK_SCALE, 'set BENCHMARK_SCALE to the number of rows to seed, e.g. BENCHMARK_SCALE=100000')
+@override_settings(CACHES=LOCMEM_CACHES)
+class BenchmarkTestCase(TestCase):
+    """Time, peak memory and query counts over a seeded dataset, written to BENCHMARK_REPORT as JSON."""
+    seed = 1234
+    results = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(cls.seed)
+        cls.user = User.objects.create_superuser('admin', 'admin@test.com', 'password')
+        clients = Client.objects.bulk_create([Client(name=f'Client {i}', user=cls.user) for i in range(5)])
+        cls.projects = Project.objects.bulk_create([Project(
+            name=f'Project {i}', client=clients[i % 5], harvest_id=str(1000 + i), project_start_date=date(2022, 1, 1),
+            monthly_duration=timedelta(hours=40)) for i in range(20)])
+        TimeEntry.objects.bulk_create([TimeEntry(
+            project=rng.choice(cls.projects), date=date(2022, 1, 1) + timedelta(days=rng.randrange(1096)),
+            hours=timedelta(minutes=rng.randrange(15, 480, 15)), notes='- Planning - Review - Fixes',
+            harvest_id=str(i), billable=rng.random() < 0.8) for i in range(BENCHMARK_SCALE)], batch_size=5000)
+        ProjectMonthRollup.refresh_projects({project.pk: date(2022, 1, 1) for project in cls.projects})
+
+        cls.source = Source.objects.create(source_type='github', project=cls.projects[0])
+        SourceRule.objects.create(source=cls.source, rule_type=SourceRule.STARTS_WITH, rule='event')
+        timestamp = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        events = []
+        for i in range(BENCHMARK_SCALE):
+            timestamp += timedelta(minutes=rng.randrange(1, 90))
+            events.append(Event(source=cls.source, event_text=f'event {i}', event_hash=Event.hash_text(f'event {i}'),
+                                timestamp=timestamp))
+        Event.objects.bulk_create(events, batch_size=5000)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        report = {
+            'scale': BENCHMARK_SCALE,
+            'seed': cls.seed,
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'results': cls.results,
+        }
+        with open(os.environ.get('BENCHMARK_REPORT', 'benchmark-report.json'), 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    @contextmanager
+    def benchmark(self, name, expected_queries):
+        tracemalloc.start()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            yield
+        elapsed = time.perf_counter() - started
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.results[name] = {
+            'seconds': round(elapsed, 4),
+            'peak_memory_kb': peak_memory // 1024,
+            'queries': len(queries),
+        }
+        if callable(expected_queries):
+            expected_queries = expected_queries()
+        self.assertEqual(len(queries), expected_queries, f'{name} ran {len(queries)} queries')
+
+    def test_timesheet_view(self):
+        self.client.force_login(self.user)
+        url = f'/timesheet/{self.projects[0].pk}/2023-06'
+        with self.benchmark('timesheet_view_cold', 9):
+            self.client.get(url)
+        with self.benchmark('timesheet_view_cached', 7):
+            self.client.get(url)
+
+    def test_harvest_time_entries(self):
+        rng = random.Random(self.seed)
+        window = TimeEntry.objects.filter(date__gte=date(2024, 12, 1)).values_list(
+            'harvest_id', 'project__harvest_id', 'date', 'hours', 'billable')
+        entries = [{
+            'id': int(harvest_id), 'project': {'id': int(project_id)}, 'spent_date': spent_date.isoformat(),
+            'hours': hours.total_seconds() / 3600 + (0.25 if rng.random() < 0.1 else 0), 'notes': '- Planning',
+            'billable': billable, 'updated_at': '2025-01-01T00:00:00Z'} for harvest_id, project_id, spent_date, hours, billable in window]
+        harvest = Harvest()
+        pages = [entries[i:i + harvest.per_page] for i in range(0, len(entries), harvest.per_page)] or [[]]
+
+        def handler(method, path, query, body, headers):
+            page = int(query['page'][0])
+            return 200, {}, {'time_entries': pages[page - 1], 'total_pages': len(pages), 'page': page}
+
+        projects = {entry['project']['id'] for entry in entries}
+        with StubServer(handler) as server:
+            harvest.base_url = server.url
+            harvest.requester.headers = {}
+            # Watermark lookup and save, upsert batches and a fixed cost per refreshed project rollup
+            expected = 11 + math.ceil(len(entries) / harvest.batch_size) + 6 * len(projects)
+            with self.benchmark('harvest_get_time_entries', expected):
+                harvest.get_time_entries(date(2024, 12, 1), date(2024, 12, 31))
+
+    def test_group_event_blocks(self):
+        project = self.projects[0]
+        # Fixed setup and streaming reads plus one insert per batch of blocks
+        def expected():
+            return 6 + math.ceil(project.eventblock_set.count() / 1000)
+
+        with self.benchmark('group_event_blocks_full', expected):
+            project.group_event_blocks(full=True)
+
+    def test_lean_startup(self):
+        imports, roots = lean_startup_imports()
+        self.results['lean_startup'] = {'import_ms': round(sum(roots.values()) / 1000, 1), 'modules': len(imports)}
+
+    def test_importer_sync(self):
+        importer = GeneratedImporter(self.source, BENCHMARK_SCALE)
+        # Five queries per full chunk, the closing flush, the rule lookup and the last_sync save
+        full_chunks, remainder = divmod(BENCHMARK_SCALE, importer.chunk_size)
+        with self.benchmark('importer_sync', 5 * full_chunks + 2 * bool(remainder) + 5):
+            importer.sync()
@@ -0,0 +1,43 @@
+import hashlib
+
+from django.core.cache import cache
+
+from project.instrumentation import record_cache
+from utils import LazyImport
+
+msal = LazyImport('msal')
+
+GRAPH_SCOPE = ['https://graph.microsoft.com/.default']
+REFRESH_MARGIN_SECONDS = 300
+
+msal_applications = {}
+
+
+def get_msal_application(tenant_id, client_id, client_secret):
+    key = (tenant_id, client_id)
+    # Rebuilt when the secret is rotated; only its hash is kept alongside the application
+    secret_hash = hashlib.sha256(client_secret.encode()).hexdigest()
+    cached_hash, application = msal_applications.get(key, (None, None))
+    if cached_hash != secret_hash:
+        application = msal.ConfidentialClientApplication(
+            client_id,
+            authority=f'https://login.microsoftonline.com/{tenant_id}',
+            client_credential=client_secret,
+        )
+        msal_applications[key] = (secret_hash, application)
+    return application
+
+
+def get_graph_token(tenant_id, client_id, client_secret):
+    # Shared through the default cache so web, CLI and Celery processes reuse one token until shortly before expiry
+    cache_key = f'graph-token:{tenant_id}:{client_id}'
+    token = cache.get(cache_key)
+    record_cache(bool(token))
+    if token:
+        return token
+    result = get_msal_application(tenant_id, client_id, client_secret).acquire_token_for_client(scopes=GRAPH_SCOPE)
+    if 'access_token' not in result:
+        raise Exception(f"Error acquiring token: {result.get('error')}")
+    timeout = max(int(result.get('expires_in', 3600)) - REFRESH_MARGIN_SECONDS, 1)
+    cache.set(cache_key, result['access_token'], timeout=timeout)
+    return result['access_token']
@@ -0,0 +1,10 @@
+from rest_framework.routers import DefaultRouter
+
+from project import api
+
+router = DefaultRouter()
+router.register('projects', api.ProjectViewSet)
+router.register('monthly-summaries', api.MonthlySummaryViewSet)
+router.register('time-entries', api.TimeEntryViewSet)
+
+urlpatterns = router.urls
@@ -1,13 +1,18 @@
+import hashlib
 import random
 from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.cache import cache
+from django.db.models import Max, Q
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.views.generic import DetailView
-from django.db.models import Min, Max
 from datetime import timedelta
 from collections import defaultdict
 
 from project import models
+from project.instrumentation import record_cache
 
 
 class ProjectTimesheetListView(LoginRequiredMixin, DetailView):
@@ -22,29 +27,80 @@ class ProjectTimesheetListView(LoginRequiredMixin, DetailView):
             return queryset
         return queryset.filter(client__user=self.request.user)
 
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        self.start_date = self.get_start_date()
+        month_start = self.start_date.replace(day=1).date()
+        # Rollup rows are rewritten from the earliest changed month onwards, so the newest one
+        # up to this month versions the month's figures and the newest overall versions the page
+        versions = self.object.projectmonthrollup_set.aggregate(
+            month=Max('updated_at', filter=Q(month__lte=month_start)), page=Max('updated_at'))
+        self.month_version = versions['month']
+
+        # Everything else the page shows outside the cached month figures. The greeting is picked at random,
+        # so only its time of day is pinned. No Last-Modified, as most of this has no timestamp to go by
+        self.projects = list(self.object.client.project_set.all())
+        page = repr((
+            versions['page'] and versions['page'].timestamp(), self.object.name, self.object.client.name,
+            self.object.eraser_embed, [(project.pk, project.name) for project in self.projects],
+            self.greeting_period(), timezone.now().astimezone(settings.AS_LOCAL_TIME_ZONE).strftime('%Y-%m'),
+        ))
+        etag = quote_etag(f"{self.month_cache_key()}:{hashlib.sha256(page.encode()).hexdigest()}")
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = self.render_to_response(self.get_context_data(object=self.object))
+            response['ETag'] = etag
+        return response
+
+    def get_start_date(self):
+        if self.kwargs['month'] == 'current':
+            return timezone.now().astimezone(settings.AS_LOCAL_TIME_ZONE)
+        elif self.kwargs['month'] == 'previous':
+            return (timezone.now().astimezone(settings.AS_LOCAL_TIME_ZONE).replace(day=1) - timedelta(days=1)).replace(day=1)
+        return timezone.datetime.strptime(self.kwargs['month'], '%Y-%m').astimezone(settings.AS_LOCAL_TIME_ZONE)
+
+    def month_cache_key(self):
+        project = self.object
+        visibility = 'all' if self.request.user.is_superuser else 'client'
+        budget = ':'.join(str(value) for value in (
+            project.project_start_date, project.monthly_duration and project.monthly_duration.total_seconds(),
+            project.total_duration and project.total_duration.total_seconds()))
+        version = self.month_version.timestamp() if self.month_version else ''
+        # 'current' is keyed by the day as the budget check below compares today against the project start
+        month = self.start_date.strftime('%Y-%m-%d' if self.kwargs['month'] == 'current' else '%Y-%m')
+        return f'timesheet:{project.pk}:{month}:{visibility}:{budget}:{version}'
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # if self.kwargs['month'] == 'all':
         #     context['event_blocks'] = context['project'].timeentry_set.all().order_by('-date')
         #     context['month'] = 'All Time'
         # else:
-        if self.kwargs['month'] == 'current':
-            start_date = timezone.now().astimezone(settings.AS_LOCAL_TIME_ZONE)
-        elif self.kwargs['month'] == 'previous':
-            start_date = (timezone.now().astimezone(settings.AS_LOCAL_TIME_ZONE).replace(day=1) - timedelta(days=1)).replace(day=1)
-        else:
-            start_date = timezone.datetime.strptime(
-                self.kwargs['month'], '%Y-%m').astimezone(settings.AS_LOCAL_TIME_ZONE)
-        context['month'] = start_date.strftime('%B %Y')
-        context['event_blocks'] = context['project'].events_in_month(start_date.month, start_date.year)
+        month_context = cache.get(self.month_cache_key())
+        record_cache(month_context is not None)
+        if month_context is None:
+            month_context = self.get_month_context()
+            cache.set(self.month_cache_key(), month_context)
+        context.update(month_context)
+
+        current_month_start = timezone.now().astimezone(settings.AS_LOCAL_TIME_ZONE).replace(day=1).date()
+        context['project_months'] = list(context['project'].projectmonthrollup_set.filter(
+            hours__gt=timedelta()).order_by('-month').values_list('month', flat=True))
+        if current_month_start not in context['project_months']:
+            context['project_months'] = [current_month_start] + context['project_months']
+        context['projects'] = self.projects
+        context['greeting'] = self.get_greeting()
+        return context
 
-        context['start_date'] = context['event_blocks'].aggregate(Min('date'))['date__min']
-        context['end_date'] = context['event_blocks'].aggregate(Max('date'))['date__max']
+    def get_month_context(self):
+        project = self.object
+        start_date = self.start_date
+        context = {'month': start_date.strftime('%B %Y')}
 
         event_blocks_by_date = defaultdict(lambda: {'events': [], 'total_duration': timedelta()})
         total_duration = timedelta()
         total_billable = timedelta()
-        for event in context['event_blocks']:
+        for event in project.events_in_month(start_date.month, start_date.year):
             date = event.date
             duration = event.hours
             if event.billable:
@@ -56,37 +112,35 @@ class ProjectTimesheetListView(LoginRequiredMixin, DetailView):
             })
             event_blocks_by_date[date]['total_duration'] += duration
             total_duration += duration
+        context['start_date'] = min(event_blocks_by_date, default=None)
+        context['end_date'] = max(event_blocks_by_date, default=None)
         context['total_billable'] = self.format_duration(total_billable)
         for date, day_data in event_blocks_by_date.items():
             day_data['total_duration'] = self.format_duration(day_data['total_duration'])
 
         context['event_blocks_by_date'] = dict(event_blocks_by_date)
 
-        current_month_start = timezone.now().astimezone(settings.AS_LOCAL_TIME_ZONE).replace(day=1).date()
         month_start = start_date.replace(day=1).date()
+        previous_rollup = models.ProjectMonthRollup.before(project, month_start)
         context['remaining_hours'] = None
-        if context['project'].monthly_duration:
+        if project.monthly_duration:
             context['month_duration'] = self.format_duration(total_duration)
-            carryover_hours = context['project'].carried_over_duration(month_start)
+            billable_before = previous_rollup.cumulative_billable_hours if previous_rollup else timedelta()
+            carryover_hours = project.carried_over_duration(month_start, billable_before)
             context['carried_over'] = self.format_duration(carryover_hours)
             # context['total_duration'] = self.format_duration(total_duration)
             budget = timezone.timedelta(hours=0)
-            if start_date.date() >= context['project'].project_start_date:
-                budget = context['project'].monthly_duration
+            if start_date.date() >= project.project_start_date:
+                budget = project.monthly_duration
             context['total_budget'] = self.format_duration(budget)
             context['remaining_hours'] = self.format_duration(budget - carryover_hours - total_billable)
-        if context['project'].total_duration:
+        if project.total_duration:
             context['month_duration'] = self.format_duration(total_duration)
-            total_before_time = context['project'].duration_before_time(month_start)
+            total_before_time = previous_rollup.cumulative_hours if previous_rollup else timedelta()
             total_with_time = total_before_time + total_duration
             context['total_duration'] = self.format_duration(total_with_time)
-            context['total_budget'] = self.format_duration(context['project'].total_duration)
-            context['remaining_hours'] = self.format_duration(context['project'].total_duration - total_with_time)
-        context['project_months'] = list(context['project'].timeentry_set.dates('date', 'month', order='DESC'))
-        if current_month_start not in context['project_months']:
-            context['project_months'] = [current_month_start] + context['project_months']
-        context['projects'] = self.get_object().client.project_set.all()
-        context['greeting'] = self.get_greeting()
+            context['total_budget'] = self.format_duration(project.total_duration)
+            context['remaining_hours'] = self.format_duration(project.total_duration - total_with_time)
         return context
 
     def format_duration(self, duration):
@@ -113,11 +167,15 @@ class ProjectTimesheetListView(LoginRequiredMixin, DetailView):
             "morning": ["Good Morning", "Guten Morgen"],
             "afternoon": ["Good Afternoon", "Guten Tag"]
         }
-        current_hour = timezone.now().astimezone(settings.AS_LOCAL_TIME_ZONE).hour
+        period = self.greeting_period()
+        if period:
+            greetings.extend(time_based_greetings[period])
 
+        return random.choice(greetings)
+
+    def greeting_period(self):
+        current_hour = timezone.now().astimezone(settings.AS_LOCAL_TIME_ZONE).hour
         if 5 <= current_hour < 12:
-            greetings.extend(time_based_greetings["morning"])
+            return "morning"
         elif 12 <= current_hour < 17:
-            greetings.extend(time_based_greetings["afternoon"])
-
-        return random.choice(greetings)
+            return "afternoon"
@@ -1,21 +1,30 @@
 import os
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "logsheet.settings")
+os.environ.setdefault("LOGSHEET_PROFILE", "lean")
 
 import django
 
 django.setup()
-import sys
+import argparse
 from project.harvest import sync_harvest_data
 
 from django.utils import timezone
 import time
 
+parser = argparse.ArgumentParser(description='Sync clients, projects and time entries from Harvest.')
+parser.add_argument('days', nargs='?', type=int, default=30, help='Number of days of time entries to sync.')
+mode = parser.add_mutually_exclusive_group()
+mode.add_argument('--full', dest='full', action='store_true', default=None,
+                  help='Re-download everything in the window and delete entries removed from Harvest.')
+mode.add_argument('--incremental', dest='full', action='store_false',
+                  help='Only fetch rows updated since the last sync.')
+args = parser.parse_args()
+
 start_time = time.time()
 
-try:
-    sync_harvest_data(int(sys.argv[1]))
-except IndexError:
-    sync_harvest_data()
+counts = sync_harvest_data(args.days, args.full)
 
-print(f'{timezone.now().isoformat()} | Synced Harvest data in {time.time() - start_time :.2f} seconds.')
+print(f'{timezone.now().isoformat()} | Synced Harvest data ({counts["mode"]}) in {time.time() - start_time :.2f} seconds. '
+      f'Fetched {counts["fetched"]}, skipped {counts["skipped"]} unchanged. '
+      f'Inserted {counts["inserted"]}, updated {counts["updated"]}, deleted {counts["deleted"]} time entries.')
@@ -1,8 +1,11 @@
+import logging
 from datetime import datetime, timedelta, date
+from importlib import import_module
 from zoneinfo import ZoneInfo
 
 from dateutil import parser
-from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
 
 
 class DateRangeIterator:
@@ -41,6 +44,6 @@ class LazyImport:
 
     def __getattr__(self, name):
         if self.module is None:
-            print(f'Importing module {self.module_name}')
-            self.module = import_string(self.module_name)
+            logger.debug('Importing module %s', self.module_name)
+            self.module = import_module(self.module_name)
         return getattr(self.module, name)